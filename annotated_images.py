@@ -0,0 +1,279 @@
+# Names and storage of the images that the annotator writes. This module
+# does not depend on Qt, so it can be used by training code.
+import io
+import os
+import re
+import mmap
+import time
+import struct
+import hashlib
+import tarfile
+import threading
+import numpy as np
+import cv2
+
+
+IMAGE_FILENAME_PATTERN = re.compile(r"annotated_([0-9a-f]{32})_\d+\.\w+$")
+
+
+def video_identifier(filename):
+    m = hashlib.md5()
+    m.update(filename.encode())
+    return m.hexdigest()
+
+
+def annotated_image_filename(output_path, video_filename, frame_idx,
+                             image_format):
+    return os.path.join(
+        output_path, "annotated_%s_%08d.%s" % (
+            video_identifier(video_filename), frame_idx, image_format))
+
+
+class ImagePack:
+    # Encoded images appended to tar files of at most shard_mb instead of
+    # one file per image, which avoids the overhead of the file system for
+    # hundreds of thousands of images. Images are identified by the name of
+    # their file, which contains the video identifier and the frame index.
+    # Each line of the append-only index contains name, tar file, offset and
+    # size of an image, later lines replace earlier lines of the same image.
+    # Images are read from memory-mapped tar files. The tar files can be read
+    # by WebDataset.
+    def __init__(self, path, prefix="images", shard_mb=1024):
+        self.path = path
+        self.prefix = prefix
+        self.max_shard_bytes = shard_mb * 1024 ** 2
+        self.index_filename = os.path.join(path, prefix + ".index")
+        self.shard_pattern = re.compile(re.escape(prefix) + r"-(\d+)\.tar$")
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.n_index_bytes = 0
+        self.maps = {}
+        self.shard = None
+        self.shard_name = None
+        self.index_file = None
+        self._read_index()
+
+    def contains(self, filename):
+        with self.lock:
+            return os.path.basename(filename) in self.entries
+
+    def read(self, filename):
+        name = os.path.basename(filename)
+        with self.lock:
+            if name not in self.entries:  # written by another process
+                self._read_index()
+            if name not in self.entries:
+                return None
+            shard_name, offset, size = self.entries[name]
+            shard_map = self.maps.get(shard_name)
+            if shard_map is None or len(shard_map) < offset + size:
+                # the shard has grown since it has been mapped
+                if shard_map is not None:
+                    shard_map.close()
+                with open(os.path.join(self.path, shard_name), "rb") as f:
+                    shard_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[shard_name] = shard_map
+            return shard_map[offset:offset + size]
+
+    def write(self, filename, data):
+        name = os.path.basename(filename)
+        with self.lock:
+            if (self.shard is None or
+                    self.shard.tell() + len(data) > self.max_shard_bytes):
+                self._open_shard()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            header = info.tobuf(tarfile.USTAR_FORMAT)
+            offset = self.shard.tell() + len(header)
+            self.shard.write(header + data + tarfile.NUL * (
+                -len(data) % tarfile.BLOCKSIZE))
+            self.shard.flush()
+            # an image is only indexed when all of its data has been written
+            self.index_file.write(
+                "%s,%s,%d,%d\n" % (name, self.shard_name, offset, len(data)))
+            self.index_file.flush()
+            self.n_index_bytes = self.index_file.tell()
+            self.entries[name] = (self.shard_name, offset, len(data))
+
+    def merge(self, prefix):
+        # moves the index of another pack in the same directory to this one
+        other = ImagePack(self.path, prefix)
+        with self.lock:
+            self._open_index()
+            for name, (shard_name, offset, size) in other.entries.items():
+                self.index_file.write(
+                    "%s,%s,%d,%d\n" % (name, shard_name, offset, size))
+                self.entries[name] = (shard_name, offset, size)
+            self.index_file.flush()
+            self.n_index_bytes = self.index_file.tell()
+        other.close()
+        if os.path.exists(other.index_filename):
+            os.remove(other.index_filename)
+
+    def _read_index(self):
+        if not os.path.exists(self.index_filename):
+            return
+        with open(self.index_filename, "rb") as f:
+            f.seek(self.n_index_bytes)
+            data = f.read()
+        # the last line is incomplete if writing has been interrupted
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode().splitlines():
+            name, shard_name, offset, size = line.split(",")
+            self.entries[name] = (shard_name, int(offset), int(size))
+        self.n_index_bytes += end
+
+    def _open_index(self):
+        if self.index_file is not None:
+            return
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._read_index()
+        self.index_file = open(self.index_filename, "a")
+        self.index_file.truncate(self.n_index_bytes)
+
+    def _open_shard(self):
+        self._open_index()
+        if self.shard is not None:
+            self._close_shard()
+            shard_end = None
+        else:
+            # we continue the last tar file after its last indexed image,
+            # data that has not been indexed is overwritten
+            shard_name, shard_end = self._last_shard()
+        if shard_end is None or shard_end >= self.max_shard_bytes:
+            shard_numbers = [-1] + [
+                int(match.group(1)) for match in map(
+                    self.shard_pattern.match, os.listdir(self.path))
+                if match is not None]
+            shard_name = "%s-%05d.tar" % (self.prefix, max(shard_numbers) + 1)
+            shard_end = 0
+        filename = os.path.join(self.path, shard_name)
+        self.shard = open(filename, "r+b" if shard_end > 0 else "wb")
+        self.shard.truncate(shard_end)
+        self.shard.seek(shard_end)
+        self.shard_name = shard_name
+
+    def _last_shard(self):
+        shard_ends = {}
+        for shard_name, offset, size in self.entries.values():
+            if self.shard_pattern.match(shard_name) is not None:
+                end = offset + size + (-size % tarfile.BLOCKSIZE)
+                shard_ends[shard_name] = max(shard_ends.get(shard_name, 0), end)
+        if len(shard_ends) == 0:
+            return None, None
+        shard_name = max(shard_ends)
+        if not os.path.exists(os.path.join(self.path, shard_name)):
+            return None, None
+        return shard_name, shard_ends[shard_name]
+
+    def _close_shard(self):
+        # end of archive, it is removed when we continue the tar file
+        self.shard.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+        self.shard.close()
+        self.shard = None
+        self.shard_name = None
+
+    def close(self):
+        with self.lock:
+            if self.shard is not None:
+                self._close_shard()
+            if self.index_file is not None:
+                self.index_file.close()
+                self.index_file = None
+            for shard_map in self.maps.values():
+                shard_map.close()
+            self.maps.clear()
+
+
+_IMAGE_PACKS = {}
+
+
+def read_encoded_image(filename):
+    # image file or image of the pack in the same directory
+    if os.path.exists(filename):
+        with open(filename, "rb") as f:
+            return f.read()
+    path = os.path.dirname(filename)
+    if path not in _IMAGE_PACKS:
+        _IMAGE_PACKS[path] = ImagePack(path)
+    data = _IMAGE_PACKS[path].read(filename)
+    if data is None:
+        raise Exception("Could not find image '%s'" % filename)
+    return data
+
+
+def read_image(filename, image_format="BGR"):
+    # images are files or packed by the annotator
+    image = cv2.imdecode(
+        np.frombuffer(read_encoded_image(filename), dtype=np.uint8),
+        cv2.IMREAD_COLOR)
+    if image_format == "RGB":
+        image = image[:, :, ::-1]
+    return image
+
+
+def read_image_size(filename):
+    # reads height and width from JPEG, PNG or WebP headers without
+    # decoding the image
+    if os.path.exists(filename):
+        f = open(filename, "rb")
+    else:
+        f = io.BytesIO(read_encoded_image(filename))
+    with f:
+        header = f.read(32)
+        if header.startswith(b"\x89PNG\r\n\x1a\n"):
+            width, height = struct.unpack(">II", header[16:24])
+            return height, width
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            size = _webp_size(header)
+            if size is not None:
+                return size
+        if header.startswith(b"\xff\xd8"):
+            f.seek(2)
+            size = _jpeg_size(f)
+            if size is not None:
+                return size
+    return read_image(filename).shape[:2]
+
+
+def _jpeg_size(f):
+    # start of frame markers, except DHT (0xc4), JPG (0xc8) and DAC (0xcc)
+    sof_markers = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        while marker[1] == 0xff:  # fill bytes
+            byte = f.read(1)
+            if len(byte) == 0:
+                return None
+            marker = marker[1:] + byte
+        if marker[1] in sof_markers:
+            segment = f.read(7)
+            if len(segment) < 7:
+                return None
+            _, _, height, width = struct.unpack(">HBHH", segment)
+            return height, width
+        if marker[1] in range(0xd0, 0xda):  # markers without payload
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        f.seek(struct.unpack(">H", length)[0] - 2, os.SEEK_CUR)
+
+
+def _webp_size(header):
+    chunk = header[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", header[26:30])
+        return height & 0x3fff, width & 0x3fff
+    if chunk == b"VP8L":
+        bits = struct.unpack("<I", header[21:25])[0]
+        return ((bits >> 14) & 0x3fff) + 1, (bits & 0x3fff) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return height, width
+    return None
@@ -0,0 +1,342 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import argparse
+import json
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import numpy as np
+import cv2
+from PyQt5.QtWidgets import QApplication
+from main import (
+    AnnotatorConfigurationModel, AnnotationModel, AnnotationStore,
+    ImageCanvas, VideoModel, ImageWriter)
+from annotated_images import (
+    ImagePack, annotated_image_filename, read_encoded_image)
+
+
+CODECS = [("mp4v", ".mp4"), ("MJPG", ".avi"), ("XVID", ".avi")]
+GOP_SIZES = [12, 250]
+
+
+def main():
+    args = parse_args()
+    app = QApplication(sys.argv)
+    tmp_dir = tempfile.mkdtemp(prefix="annotator_benchmark_")
+    results = {}
+    try:
+        video_filenames = generate_videos(
+            tmp_dir, args.n_frames, tuple(args.source_resolution))
+        image_size = tuple(args.resolution)
+        for name, filename in video_filenames.items():
+            results.update(benchmark_video(name, filename, image_size))
+        video = video_filenames[sorted(video_filenames)[0]]
+        for n_rows in args.n_rows:
+            for annotation_format in AnnotationStore.FORMATS:
+                results.update(benchmark_annotations(
+                    tmp_dir, video, args.n_frames, n_rows, annotation_format,
+                    image_size))
+        results.update(benchmark_canvas(tmp_dir, video, image_size))
+        for image_storage in ImageWriter.STORAGES:
+            results.update(benchmark_images(
+                tmp_dir, video, image_storage, args.n_images))
+        results.update(benchmark_dataset(tmp_dir, video, image_size))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    report = {"commit": _git_commit(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "opencv": cv2.__version__,
+              "machine": platform.machine(), "n_cpus": os.cpu_count(),
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print_results(results, args.compare)
+
+
+def generate_videos(tmp_dir, n_frames, size):
+    # textured background that moves and a few rectangles so that the
+    # codecs have to encode motion
+    random_state = np.random.RandomState(0)
+    texture = random_state.randint(
+        0, 256, (size[1] // 8, size[0] // 8, 3)).astype(np.uint8)
+    texture = cv2.resize(texture, size, interpolation=cv2.INTER_LINEAR)
+    key_interval = getattr(cv2, "VIDEOWRITER_PROP_KEY_INTERVAL", None)
+
+    video_filenames = {}
+    for fourcc, extension in CODECS:
+        for gop_size in GOP_SIZES:
+            if fourcc == "MJPG" and gop_size != GOP_SIZES[0]:
+                continue  # every frame is a keyframe
+            if key_interval is None and gop_size != GOP_SIZES[0]:
+                continue
+            name = "%s_gop%d" % (fourcc, gop_size)
+            filename = os.path.join(tmp_dir, name + extension)
+            params = []
+            if key_interval is not None and fourcc != "MJPG":
+                params = [key_interval, gop_size]
+            writer = cv2.VideoWriter(
+                filename, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*fourcc), 30.0,
+                size, params)
+            if not writer.isOpened():
+                print("Skipping unsupported codec %s" % fourcc)
+                continue
+            for i in range(n_frames):
+                image = np.roll(texture, 4 * i, axis=1)
+                for j in range(5):
+                    x = (50 * j + 7 * i) % (size[0] - 100)
+                    y = (80 * j + 3 * i) % (size[1] - 100)
+                    cv2.rectangle(image, (x, y), (x + 100, y + 100),
+                                  (50 * j, 255 - 50 * j, 128), -1)
+                writer.write(image)
+            writer.release()
+            video_filenames[name] = filename
+    return video_filenames
+
+
+def benchmark_video(name, filename, image_size):
+    video_model = VideoModel(
+        filename, image_size, frame_cache_mb=0, image_writer=ImageWriter())
+    _wait_for_background_passes(video_model)
+    n_frames = video_model.n_frames
+    results = {}
+    results["video/%s/next_frame" % name] = measure(
+        video_model.next_frame, n_frames - 1)
+
+    random_state = np.random.RandomState(0)
+    targets = iter(random_state.randint(0, n_frames, 50).tolist())
+    results["video/%s/jump" % name] = measure(
+        lambda: video_model.jump(next(targets) - video_model.frame_idx), 50)
+    video_model.close()
+    return results
+
+
+def benchmark_annotations(tmp_dir, video, n_frames, n_rows, annotation_format,
+                          image_size):
+    # n_rows boxes distributed over all frames of the video
+    output_path = os.path.join(
+        tmp_dir, "annotations_%d_%s" % (n_rows, annotation_format))
+    os.makedirs(output_path)
+    config = _config(tmp_dir, image_size, annotation_format)
+    store = _synthetic_store(output_path, video, n_frames, n_rows, config)
+    annotations_filename = os.path.join(
+        output_path, "annotations." + annotation_format)
+    store.save(annotations_filename)
+
+    prefix = "annotations/%d/%s/" % (n_rows, annotation_format)
+    results = {}
+    results[prefix + "store_load"] = measure(
+        lambda: AnnotationStore().load(annotations_filename), 3)
+    results[prefix + "store_save"] = measure(
+        lambda: store.save(annotations_filename), 3)
+
+    model = AnnotationModel([video], output_path, config)
+    _wait_for_background_passes(model.video_model)
+    results[prefix + "model_load"] = measure(model.load, 3)
+    results[prefix + "next_image"] = measure(model.next_image, 100)
+    results[prefix + "skip_back"] = measure(lambda: model.skip(-1), 100)
+
+    def save():
+        model.save()
+        model.compaction.join()
+    results[prefix + "model_save"] = measure(save, 3)
+    model.close()
+    return results
+
+
+def benchmark_canvas(tmp_dir, video, image_size):
+    output_path = os.path.join(tmp_dir, "canvas")
+    config = _config(tmp_dir, image_size)
+    model = AnnotationModel([video], output_path, config)
+    _wait_for_background_passes(model.video_model)
+    for i in range(20):
+        model.add_box([20 * i, 10 * i], [20 * i + 100, 10 * i + 80], i % 2)
+    canvas = ImageCanvas(None, config, model)
+    canvas.show()
+
+    def update_image():
+        canvas.update_image()
+        canvas.img_view.repaint()
+
+    def update_annotation():
+        canvas.update_annotation()
+        canvas.img_view.repaint()
+
+    def drag():
+        canvas.start_drag(100, 100)
+        canvas.drag(300, 200)
+        canvas.img_view.repaint()
+        canvas.img_view.clear_rubber_band()
+
+    results = {
+        "canvas/update_image": measure(update_image, 100),
+        "canvas/update_annotation": measure(update_annotation, 100),
+        "canvas/drag": measure(drag, 100)}
+    canvas.close()
+    model.close()
+    return results
+
+
+def benchmark_images(tmp_dir, video, image_storage, n_images, size=(320, 180)):
+    # many small images are written and read in random order
+    output_path = os.path.join(tmp_dir, "images_%s" % image_storage)
+    os.makedirs(output_path)
+    random_state = np.random.RandomState(0)
+    image = random_state.randint(0, 256, (size[1], size[0], 3)).astype(np.uint8)
+    image_filenames = [annotated_image_filename(output_path, video, i, "jpg")
+                       for i in range(n_images)]
+
+    def write():
+        pack = None
+        if image_storage == "packed":
+            pack = ImagePack(output_path)
+        image_writer = ImageWriter(pack=pack)
+        for image_filename in image_filenames:
+            image_writer.submit(image_filename, image)
+        image_writer.close()
+
+    def read():
+        for i in random_state.permutation(n_images):
+            read_encoded_image(image_filenames[i])
+
+    return {"images/%d/%s/write" % (n_images, image_storage): measure(write, 1),
+            "images/%d/%s/read" % (n_images, image_storage): measure(read, 3)}
+
+
+def benchmark_dataset(tmp_dir, video, image_size, n_images=500):
+    try:
+        from examples.dataset_utils import get_annotated_dataset, CACHE_FILENAME
+    except ImportError as e:
+        print("Skipping dataset benchmark: %s" % e)
+        return {}
+    dataset_dir = os.path.join(tmp_dir, "dataset")
+    os.makedirs(dataset_dir)
+    config = _config(tmp_dir, image_size)
+    store = _synthetic_store(dataset_dir, video, n_images, 5 * n_images, config)
+    image_writer = ImageWriter(config.image_format)
+    image = np.zeros((image_size[1], image_size[0], 3), dtype=np.uint8)
+    for image_filename, _ in store.frames.keys():
+        image_writer.submit(image_filename, image)
+    image_writer.close()
+    # image filenames are relative to the root directory
+    relative_store = AnnotationStore()
+    for (image_filename, frame_idx), boxes in store.frames.items():
+        relative_store.replace(
+            os.path.relpath(image_filename, tmp_dir), frame_idx, boxes)
+    relative_store.save(os.path.join(dataset_dir, "annotations.csv"))
+
+    def build():
+        os.remove(os.path.join(dataset_dir, CACHE_FILENAME))
+        get_annotated_dataset(tmp_dir, ["dataset"])
+
+    get_annotated_dataset(tmp_dir, ["dataset"])
+    return {
+        "dataset/%d/build" % n_images: measure(build, 3),
+        "dataset/%d/cached" % n_images: measure(
+            lambda: get_annotated_dataset(tmp_dir, ["dataset"]), 3)}
+
+
+def _config(tmp_dir, image_size, annotation_format="csv"):
+    config_filename = os.path.join(tmp_dir, "config_%s.yaml" % annotation_format)
+    with open(config_filename, "w") as f:
+        f.write("classes: [a, b]\nresolution: [%d, %d]\nannotation_format: %s\n"
+                % (image_size[0], image_size[1], annotation_format))
+    return AnnotatorConfigurationModel(config_filename)
+
+
+def _synthetic_store(output_path, video, n_frames, n_rows, config,
+                     boxes_per_frame=5):
+    # frames beyond the length of the video belong to other videos
+    random_state = np.random.RandomState(0)
+    boxes = np.empty((n_rows, AnnotationStore.N_COLUMNS), dtype=np.int32)
+    boxes[:, :2] = random_state.randint(0, 200, (n_rows, 2))
+    boxes[:, 2:4] = boxes[:, :2] + random_state.randint(10, 200, (n_rows, 2))
+    boxes[:, 4] = random_state.randint(0, config.n_classes, n_rows)
+    boxes[:, 5] = np.arange(n_rows)
+    boxes[:, 6] = 1
+    store = AnnotationStore()
+    for i, frame_boxes in enumerate(np.split(
+            boxes, np.arange(boxes_per_frame, n_rows, boxes_per_frame))):
+        video_idx, frame_idx = divmod(i, n_frames)
+        video_filename = video if video_idx == 0 else "%s_%d" % (video, video_idx)
+        store.replace(annotated_image_filename(
+            output_path, video_filename, frame_idx, config.image_format),
+            frame_idx, frame_boxes)
+    return store
+
+
+def _wait_for_background_passes(video_model):
+    # they would compete with the measured decoder
+    threads = [video_model.keyframe_index.thread, video_model.thumbnails.thread]
+    if video_model.proxy is not None:
+        threads.append(video_model.proxy.thread)
+    for thread in threads:
+        if thread is not None:
+            thread.join()
+
+
+def measure(function, n_repeat):
+    times = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times = 1000.0 * np.array(times)
+    return {"n": n_repeat, "mean_ms": float(np.mean(times)),
+            "p50_ms": float(np.percentile(times, 50)),
+            "p95_ms": float(np.percentile(times, 95)),
+            "total_s": float(np.sum(times) / 1000.0)}
+
+
+def print_results(results, compare_filename=None):
+    previous = {}
+    if compare_filename is not None:
+        with open(compare_filename, "r") as f:
+            previous = json.load(f)["results"]
+    for name in sorted(results):
+        line = "%-45s p50 %9.3f ms  p95 %9.3f ms" % (
+            name, results[name]["p50_ms"], results[name]["p95_ms"])
+        if name in previous:
+            line += "  %+6.1f%%" % (
+                100.0 * (results[name]["p50_ms"] / previous[name]["p50_ms"] - 1.0))
+        print(line)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Annotator benchmarks")
+    parser.add_argument(
+        "--output", default="benchmark_results.json",
+        help="JSON file for the results")
+    parser.add_argument(
+        "--compare", default=None,
+        help="JSON file with results of an earlier run to compare with")
+    parser.add_argument("--n_frames", default=300, type=int,
+                        help="Frames of the synthetic videos")
+    parser.add_argument(
+        "--n_rows", nargs="+", type=int, default=[10000, 100000, 1000000],
+        help="Number of annotated boxes")
+    parser.add_argument("--n_images", default=10000, type=int,
+                        help="Number of written images")
+    parser.add_argument(
+        "--source_resolution", nargs=2, type=int, default=[1920, 1080],
+        help="Resolution of the synthetic videos")
+    parser.add_argument(
+        "--resolution", nargs=2, type=int, default=[1280, 720],
+        help="Resolution of the annotator")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
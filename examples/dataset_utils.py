@@ -1,34 +1,154 @@
 import os
+import copy
+import pickle
+import hashlib
+import numpy as np
 import pandas as pd
-import cv2
 import glob
+import torch
 from detectron2.structures import BoxMode
+from detectron2.data import DatasetMapper
+from detectron2.data import detection_utils as utils
+import detectron2.data.transforms as T
+from annotated_images import read_image, read_image_size
 
 
-def get_annotated_dataset(root_dir, dataset_dirs):
-    dataset_dicts = []
+CACHE_FILENAME = "dataset_cache.pkl"
+
 
+def get_annotated_dataset(root_dir, dataset_dirs, image_size=None):
+    # All images written by the annotator have the configured resolution
+    # (width, height). Image sizes are only read from the files if it is not
+    # given.
+    if image_size is not None:
+        image_size = tuple(image_size)
+    dataset_dicts = []
     for dataset_dir in dataset_dirs:
-        annotations_df = pd.read_csv(
-            os.path.join(root_dir, dataset_dir, "annotations.csv"),
-            names=["filename", "frame_idx", "tlx", "tly", "brx", "bry", "class"])
-        annotations_per_file = annotations_df.groupby(annotations_df.filename)
-
-        for filename, bbs in annotations_per_file:
-            record = {}
-            record["file_name"] = os.path.join(root_dir, filename)
-            im = cv2.imread(record["file_name"], cv2.IMREAD_COLOR)
-            record["height"], record["width"] = im.shape[:2]
-
-            record["annotations"] = []
-            for _, row in bbs.iterrows():
-                bb = row[["tlx", "tly", "brx", "bry"]].to_numpy(dtype=float).tolist()
-                record["annotations"].append({
-                    "bbox": bb,
-                    "bbox_mode": BoxMode.XYXY_ABS,
-                    "category_id": row["class"],
-                    "iscrowd": 0
-                })
-            dataset_dicts.append(record)
+        dataset_dicts.extend(_get_cached_dataset(
+            root_dir, os.path.join(root_dir, dataset_dir), image_size))
+    return dataset_dicts
+
+
+def _get_cached_dataset(root_dir, dataset_dir, image_size=None):
+    annotations_filename = os.path.join(dataset_dir, "annotations.npz")
+    if not os.path.exists(annotations_filename):
+        annotations_filename = os.path.join(dataset_dir, "annotations.csv")
+    cache_filename = os.path.join(dataset_dir, CACHE_FILENAME)
+    # reviewed flags of CSV annotations are stored in a separate file
+    filenames = [annotations_filename]
+    attributes_filename = _attributes_filename(annotations_filename)
+    if annotations_filename.endswith(".csv") and os.path.exists(attributes_filename):
+        filenames.append(attributes_filename)
+    mtime = [os.path.getmtime(filename) for filename in filenames]
+
+    cache = None
+    if os.path.exists(cache_filename):
+        with open(cache_filename, "rb") as f:
+            cache = pickle.load(f)
+        if (cache["annotations"] != annotations_filename or
+                cache["root_dir"] != root_dir or
+                cache.get("image_size") != image_size):
+            cache = None
+    if cache is not None and cache["mtime"] == mtime:
+        return cache["records"]
+
+    # the file might have been touched without changing its content
+    md5 = [_md5(filename) for filename in filenames]
+    if cache is not None and cache["md5"] == md5:
+        records = cache["records"]
+    else:
+        records = _build_dataset(root_dir, annotations_filename, image_size)
+
+    with open(cache_filename, "wb") as f:
+        pickle.dump({"annotations": annotations_filename, "root_dir": root_dir,
+                     "image_size": image_size, "mtime": mtime, "md5": md5,
+                     "records": records}, f)
+    return records
+
+
+def _md5(filename):
+    m = hashlib.md5()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b""):
+            m.update(chunk)
+    return m.hexdigest()
 
+
+def _build_dataset(root_dir, annotations_filename, image_size=None):
+    filenames, filename_idx, boxes, classes = _load_annotations(
+        annotations_filename)
+    if len(filename_idx) == 0:
+        return []
+
+    order = np.argsort(filename_idx, kind="stable")
+    filename_idx, boxes, classes = filename_idx[order], boxes[order], classes[order]
+    starts = np.flatnonzero(filename_idx[1:] != filename_idx[:-1]) + 1
+
+    dataset_dicts = []
+    for file_boxes, file_classes, idx in zip(
+            np.split(boxes, starts), np.split(classes, starts),
+            filename_idx[np.r_[0, starts]]):
+        record = {}
+        record["file_name"] = os.path.join(root_dir, filenames[idx])
+        if image_size is None:
+            record["height"], record["width"] = read_image_size(record["file_name"])
+        else:
+            record["width"], record["height"] = image_size
+        record["annotations"] = [{
+            "bbox": bb,
+            "bbox_mode": BoxMode.XYXY_ABS,
+            "category_id": category_id,
+            "iscrowd": 0
+        } for bb, category_id in zip(file_boxes.tolist(), file_classes.tolist())]
+        dataset_dicts.append(record)
     return dataset_dicts
+
+
+def _load_annotations(filename):
+    # boxes that have been suggested but not reviewed are skipped
+    if filename.endswith(".npz"):
+        with np.load(filename) as annotations:
+            reviewed = np.ones(len(annotations["classes"]), dtype=bool)
+            if "reviewed" in annotations:
+                reviewed = annotations["reviewed"].astype(bool)
+            return (annotations["filenames"],
+                    annotations["filename_idx"][reviewed],
+                    annotations["boxes"][reviewed].astype(float),
+                    annotations["classes"][reviewed])
+
+    annotations_df = pd.read_csv(
+        filename,
+        names=["filename", "frame_idx", "tlx", "tly", "brx", "bry", "class"])
+    attributes_filename = _attributes_filename(filename)
+    if os.path.exists(attributes_filename):
+        attributes = np.load(attributes_filename)
+        if attributes.shape == (len(annotations_df), 2):
+            annotations_df = annotations_df[attributes[:, 1].astype(bool)]
+    filename_idx, filenames = pd.factorize(annotations_df["filename"])
+    boxes = annotations_df[["tlx", "tly", "brx", "bry"]].to_numpy(dtype=float)
+    classes = annotations_df["class"].to_numpy(dtype=int)
+    return np.asarray(filenames), filename_idx, boxes, classes
+
+
+def _attributes_filename(filename):
+    return os.path.splitext(filename)[0] + "_attributes.npy"
+
+
+class PackedDatasetMapper(DatasetMapper):
+    # Like DatasetMapper, but reads images with read_image
+    def __call__(self, dataset_dict):
+        dataset_dict = copy.deepcopy(dataset_dict)
+        image = read_image(dataset_dict["file_name"], self.image_format)
+        utils.check_image_size(dataset_dict, image)
+        aug_input = T.AugInput(image)
+        transforms = self.augmentations(aug_input)
+        image = aug_input.image
+        image_shape = image.shape[:2]
+        dataset_dict["image"] = torch.as_tensor(
+            np.ascontiguousarray(image.transpose(2, 0, 1)))
+        if not self.is_train:
+            dataset_dict.pop("annotations", None)
+            return dataset_dict
+        if "annotations" in dataset_dict:
+            self._transform_annotations(dataset_dict, transforms, image_shape)
+        return dataset_dict
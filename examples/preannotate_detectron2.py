@@ -0,0 +1,132 @@
+import sys
+PATH_TO_DETECTRON2 = "detectron2"
+sys.path.append(PATH_TO_DETECTRON2)
+import argparse
+import time
+from functools import partial
+import detectron2
+from detectron2.utils.logger import setup_logger
+setup_logger()
+from detectron2.config import get_cfg
+import numpy as np
+import cv2
+import os
+from examples.video_pipeline import (
+    read_video, map_ordered, batches, StageStatistics, BatchPredictor)
+from main import (
+    AnnotatorConfigurationModel, AnnotationStore, AnnotationJournal,
+    ImageWriter, expand_video_filenames)
+from annotated_images import (
+    ImagePack, annotated_image_filename, video_identifier)
+
+
+def main():
+    args = parse_args()
+
+    config = AnnotatorConfigurationModel(args.config)
+
+    cfg = get_cfg()
+    cfg.merge_from_file(args.model_config)
+    cfg.MODEL.ROI_HEADS.NUM_CLASSES = config.n_classes
+    if args.model_weights is None:
+        cfg.MODEL.WEIGHTS = os.path.join(cfg.OUTPUT_DIR, "model_final.pth")
+    else:
+        cfg.MODEL.WEIGHTS = args.model_weights
+    cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = args.score_threshold
+    cfg.MODEL.DEVICE = args.device
+    predictor = BatchPredictor(cfg)
+
+    os.makedirs(args.output, exist_ok=True)
+    annotations_filename = os.path.join(
+        args.output, "annotations." + config.annotation_format)
+    store = AnnotationStore()
+    csv_filename = os.path.join(args.output, "annotations.csv")
+    if os.path.exists(annotations_filename):
+        store.load(annotations_filename)
+    elif os.path.exists(csv_filename):
+        store.load(csv_filename)
+    # Unsaved changes of the last annotation session take precedence. The
+    # journal is kept, because the images of these frames have not been
+    # written yet. The annotator writes them when it replays the journal.
+    journal = AnnotationJournal(os.path.join(args.output, "annotations.journal"))
+    journal.replay(store)
+    next_track_id = store.max_track_id() + 1
+
+    pack = None
+    if config.image_storage == "packed":
+        pack = ImagePack(args.output, shard_mb=config.pack_shard_mb)
+    image_writer = ImageWriter(
+        config.image_format, config.image_quality, config.n_writer_threads,
+        config.frame_buffer_mb, pack)
+    statistics = StageStatistics()
+    n_frames = 0
+    n_boxes = 0
+    for video in expand_video_filenames(args.video):
+        annotated_frames = store.video_frames(video_identifier(video))
+        frames = read_video(video, args.skip_frames, statistics=statistics)
+        frames = map_ordered(
+            partial(resize_frame, image_size=config.image_size), frames,
+            args.n_threads, stage="resize", statistics=statistics)
+        for batch in batches(frames, args.batch_size):
+            start = time.time()
+            outputs = predictor([image for _, image in batch])
+            statistics.add("inference", len(batch), time.time() - start)
+            for (frame_idx, image), output in zip(batch, outputs):
+                if annotated_frames.image_filename(frame_idx) is not None:
+                    continue  # already annotated
+                image_filename = annotated_image_filename(
+                    args.output, video, frame_idx, config.image_format)
+                instances = output["instances"].to("cpu")
+                if len(instances) == 0:
+                    continue
+                boxes = np.empty(
+                    (len(instances), AnnotationStore.N_COLUMNS), dtype=np.int32)
+                boxes[:, :4] = np.round(instances.pred_boxes.tensor.numpy())
+                boxes[:, 0:4:2] = np.clip(boxes[:, 0:4:2], 0, config.image_size[0])
+                boxes[:, 1:4:2] = np.clip(boxes[:, 1:4:2], 0, config.image_size[1])
+                boxes[:, 4] = instances.pred_classes.numpy()
+                boxes[:, 5] = np.arange(next_track_id, next_track_id + len(boxes))
+                boxes[:, 6] = 0  # not reviewed
+                next_track_id += len(boxes)
+                store.replace(image_filename, frame_idx, boxes)
+                if not image_writer.exists(image_filename):
+                    image_writer.submit(image_filename, image)
+                n_frames += 1
+                n_boxes += len(boxes)
+    image_writer.close()
+
+    store.save(annotations_filename)
+    print("Suggested %d boxes in %d frames" % (n_boxes, n_frames))
+    statistics.report()
+
+
+def resize_frame(item, image_size):
+    frame_idx, image = item
+    return frame_idx, cv2.resize(image, image_size)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-annotate videos")
+    parser.add_argument("video", nargs="+", help="Video files")
+    parser.add_argument("output", help="Output directory of the annotator")
+    parser.add_argument("--skip_frames", default=30, type=int, help="Skip N frames")
+    parser.add_argument("--batch_size", default=4, type=int,
+                        help="Number of frames per forward pass")
+    parser.add_argument("--n_threads", default=4, type=int,
+                        help="Threads for resizing frames")
+    parser.add_argument("--score_threshold", default=0.7, type=float,
+                        help="Minimum score of suggested boxes")
+    parser.add_argument("--device", default="cpu", help="Device of the model")
+    parser.add_argument("--model_weights", default=None, help="Model weights.")
+    parser.add_argument(
+        "--model_config",
+        default=os.path.join(PATH_TO_DETECTRON2, "configs/COCO-Detection/faster_rcnn_R_50_FPN_1x.yaml"),
+        help="Model configuration file.")
+    parser.add_argument(
+        "--config", nargs="?", default="config.yaml",
+        help="Configuration file for annotator")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,12 +16,11 @@ from detectron2.utils.visualizer import ColorMode
 from detectron2.data import DatasetCatalog
 from detectron2.data import MetadataCatalog
 import numpy as np
-import cv2
 import os
 import random
 import matplotlib.pyplot as plt
 import tqdm
-from examples.dataset_utils import get_annotated_dataset
+from examples.dataset_utils import get_annotated_dataset, read_image
 
 
 def main():
@@ -35,7 +34,7 @@ def main():
     classes = config["classes"]
 
     for d in ["test"]:
-        DatasetCatalog.register("custom_" + d, lambda d=d: get_annotated_dataset(args.annotator_root, args.data_folders))
+        DatasetCatalog.register("custom_" + d, lambda d=d: get_annotated_dataset(args.annotator_root, args.data_folders, config.get("resolution")))
         MetadataCatalog.get("custom_" + d).set(thing_classes=classes)
     custom_metadata = MetadataCatalog.get("custom_test")
 
@@ -58,9 +57,9 @@ def main():
 
         predictor = DefaultPredictor(cfg)
 
-    dataset_dicts = get_annotated_dataset(args.annotator_root, args.data_folders)
+    dataset_dicts = get_annotated_dataset(args.annotator_root, args.data_folders, config.get("resolution"))
     for d in tqdm.tqdm(random.sample(dataset_dicts, args.n_samples)):
-        im = cv2.imread(d["file_name"])
+        im = read_image(d["file_name"])
         vis = Visualizer(im[:, :, ::-1],
                     metadata=custom_metadata, 
                     scale=0.8
@@ -8,7 +8,6 @@ import torchvision
 import detectron2
 from detectron2.utils.logger import setup_logger
 setup_logger()
-from detectron2.engine import DefaultPredictor
 from detectron2.engine import DefaultTrainer
 from detectron2.config import get_cfg
 from detectron2.utils.video_visualizer import VideoVisualizer
@@ -19,9 +18,12 @@ import numpy as np
 import cv2
 import os
 import random
+import time
 import matplotlib.pyplot as plt
 import tqdm
 from examples.dataset_utils import get_annotated_dataset
+from examples.video_pipeline import (
+    read_video, map_ordered, batches, StageStatistics, BatchPredictor)
 
 
 def main():
@@ -50,7 +52,7 @@ def main():
     cfg.MODEL.ROI_HEADS.SCORE_THRESH_TEST = 0.7   # set the testing threshold for this model
     cfg.DATASETS.TEST = ("custom_test",)
 
-    predictor = DefaultPredictor(cfg)
+    predictor = BatchPredictor(cfg)
 
     DatasetCatalog.register("custom_test", lambda d="test": None)
     MetadataCatalog.get("custom_test").set(thing_classes=classes)
@@ -60,25 +62,60 @@ def main():
 
     cap = cv2.VideoCapture(args.video)
     n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
     vis = VideoVisualizer(metadata=custom_metadata)
-    for i in tqdm.tqdm(range(0, n_frames, args.skip_frames)):
-        assert cap.isOpened()
-        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-        success, image = cap.read()
-        assert success
-        outputs = predictor(image)
-        v = vis.draw_instance_predictions(
-            image[:, :, ::-1], outputs["instances"].to("cpu"))
-        filename = os.path.join(args.output, "prediction_%09d.jpg" % i)
-        cv2.imwrite(filename, v.get_image()[:, :, ::-1])
+
+    # Decoding, inference, drawing and JPEG encoding run at the same time.
+    # The video visualizer keeps track of instances across frames, so
+    # drawing happens in a single thread.
+    statistics = StageStatistics()
+    frames = read_video(
+        args.video, args.skip_frames, args.max_queued, statistics=statistics)
+    predictions = predict(predictor, frames, args.batch_size, statistics)
+    drawn = map_ordered(
+        lambda prediction: draw(vis, prediction), predictions, 1,
+        args.max_queued, stage="draw", statistics=statistics)
+    written = map_ordered(
+        lambda drawing: write(args.output, drawing), drawn, args.n_threads,
+        args.max_queued, stage="encode", statistics=statistics)
+    for _ in tqdm.tqdm(written, total=len(range(0, n_frames, args.skip_frames))):
+        pass
+    statistics.report()
     plt.show()
 
 
+def predict(predictor, frames, batch_size, statistics):
+    for batch in batches(frames, batch_size):
+        start = time.time()
+        outputs = predictor([image for _, image in batch])
+        statistics.add("inference", len(batch), time.time() - start)
+        for (i, image), output in zip(batch, outputs):
+            yield i, image, output["instances"].to("cpu")
+
+
+def draw(vis, prediction):
+    i, image, instances = prediction
+    v = vis.draw_instance_predictions(image[:, :, ::-1], instances)
+    return i, v.get_image()[:, :, ::-1]
+
+
+def write(output, drawing):
+    i, image = drawing
+    filename = os.path.join(output, "prediction_%09d.jpg" % i)
+    cv2.imwrite(filename, image)
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Annotator")
     parser.add_argument("video", help="Video file")
     parser.add_argument("output", help="Output directory")
     parser.add_argument("--skip_frames", default=1, type=int, help="Skip N frames")
+    parser.add_argument("--batch_size", default=1, type=int,
+                        help="Number of frames per forward pass")
+    parser.add_argument("--n_threads", default=4, type=int,
+                        help="Threads for JPEG encoding")
+    parser.add_argument("--max_queued", default=16, type=int,
+                        help="Maximum number of frames between two stages")
     parser.add_argument("--model_weights", default=None, help="Model weights.")
     parser.add_argument(
         "--model_config",
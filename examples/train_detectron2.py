@@ -14,9 +14,18 @@ from detectron2.config import get_cfg
 from detectron2.utils.visualizer import Visualizer
 from detectron2.data import DatasetCatalog
 from detectron2.data import MetadataCatalog
+from detectron2.data import build_detection_train_loader
 import numpy as np
 import os
-from examples.dataset_utils import get_annotated_dataset
+from examples.dataset_utils import get_annotated_dataset, PackedDatasetMapper
+
+
+class Trainer(DefaultTrainer):
+    # images might be packed by the annotator
+    @classmethod
+    def build_train_loader(cls, cfg):
+        return build_detection_train_loader(
+            cfg, mapper=PackedDatasetMapper(cfg, True))
 
 
 def main():
@@ -30,7 +39,7 @@ def main():
     classes = config["classes"]
 
     for d in ["train"]:
-        DatasetCatalog.register("custom_" + d, lambda d=d: get_annotated_dataset(args.annotator_root, args.data_folders))
+        DatasetCatalog.register("custom_" + d, lambda d=d: get_annotated_dataset(args.annotator_root, args.data_folders, config.get("resolution")))
         MetadataCatalog.get("custom_" + d).set(thing_classes=classes)
     custom_metadata = MetadataCatalog.get("custom_train")
 
@@ -47,7 +56,7 @@ def main():
     cfg.MODEL.ROI_HEADS.NUM_CLASSES = len(classes)
 
     os.makedirs(cfg.OUTPUT_DIR, exist_ok=True)
-    trainer = DefaultTrainer(cfg) 
+    trainer = Trainer(cfg)
     trainer.resume_or_load(resume=False)
     trainer.train()
 
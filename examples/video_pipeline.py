@@ -0,0 +1,152 @@
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import torch
+from detectron2.modeling import build_model
+from detectron2.checkpoint import DetectionCheckpointer
+import detectron2.data.transforms as T
+
+
+_END = object()
+
+
+def read_video(filename, skip_frames=1, max_queued=32, statistics=None):
+    # Decodes every skip_frames-th frame in a background thread. The video is
+    # read sequentially, frames in between are skipped with grab() which
+    # does not convert them to images.
+    frames = queue.Queue(max_queued)
+    stop = threading.Event()
+    errors = []
+
+    def decode():
+        cap = cv2.VideoCapture(filename)
+        try:
+            frame_idx = 0
+            while not stop.is_set():
+                start = time.time()
+                while frame_idx % skip_frames != 0 and cap.grab():
+                    frame_idx += 1
+                success, image = cap.read()
+                if not success:
+                    break
+                if statistics is not None:
+                    statistics.add("decode", 1, time.time() - start)
+                _put(frames, (frame_idx, image), stop)
+                frame_idx += 1
+        except Exception as e:
+            errors.append(e)
+        finally:
+            cap.release()
+            _put(frames, _END, stop)
+
+    thread = threading.Thread(target=decode)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is _END:
+                break
+            yield item
+        if len(errors) > 0:
+            raise errors[0]
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _put(items, item, stop):
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def map_ordered(function, iterable, n_threads=4, max_pending=None,
+                stage=None, statistics=None):
+    # Applies function to the items in a thread pool and yields the results
+    # in order. At most max_pending items are processed at the same time.
+    if max_pending is None:
+        max_pending = 2 * n_threads
+
+    def timed(item):
+        start = time.time()
+        result = function(item)
+        if statistics is not None:
+            statistics.add(stage, 1, time.time() - start)
+        return result
+
+    with ThreadPoolExecutor(n_threads) as pool:
+        pending = deque()
+        for item in iterable:
+            pending.append(pool.submit(timed, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+class StageStatistics:
+    # Number of items and accumulated processing time per pipeline stage.
+    # Stages that run in several threads are busy for longer than the wall
+    # time.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = OrderedDict()
+        self.start = time.time()
+
+    def add(self, stage, n_items, seconds):
+        with self.lock:
+            total_items, total_seconds = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (total_items + n_items, total_seconds + seconds)
+
+    def report(self):
+        wall_time = time.time() - self.start
+        with self.lock:
+            for stage, (n_items, seconds) in self.stages.items():
+                print("%-10s %7d items %8.1f items/s busy %8.1f items/s total"
+                      % (stage, n_items, n_items / max(seconds, 1e-9),
+                         n_items / max(wall_time, 1e-9)))
+
+
+class BatchPredictor:
+    # Like DefaultPredictor, but runs the model on a list of BGR images at
+    # once. Predicted boxes are given in the coordinates of the input images.
+    def __init__(self, cfg):
+        self.cfg = cfg.clone()
+        self.model = build_model(self.cfg)
+        self.model.eval()
+        DetectionCheckpointer(self.model).load(cfg.MODEL.WEIGHTS)
+        self.aug = T.ResizeShortestEdge(
+            [cfg.INPUT.MIN_SIZE_TEST, cfg.INPUT.MIN_SIZE_TEST],
+            cfg.INPUT.MAX_SIZE_TEST)
+        self.input_format = cfg.INPUT.FORMAT
+
+    def __call__(self, images):
+        inputs = []
+        for image in images:
+            if self.input_format == "RGB":
+                image = image[:, :, ::-1]
+            height, width = image.shape[:2]
+            resized = self.aug.get_transform(image).apply_image(image)
+            tensor = torch.as_tensor(
+                resized.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": tensor, "height": height, "width": width})
+        with torch.no_grad():
+            return self.model(inputs)
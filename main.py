@@ -1,31 +1,142 @@
 import os
 import sys
 import argparse
-import hashlib
+import io
+import json
+import time
+import tarfile
+import contextlib
+import gc
 import yaml
 import warnings
-from functools import partial
+from functools import partial, wraps
 import csv
+import glob
+import shutil
+import tempfile
+import threading
+import multiprocessing
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque, OrderedDict
 from PyQt5.QtCore import pyqtSignal, QRect, QPoint, Qt, QObject, QTimer
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QTabWidget, QWidget, QSpinBox,
     QLabel, QVBoxLayout, QHBoxLayout, QSplitter, QSizePolicy,
-    QPushButton, QGridLayout, QProgressBar, QShortcut, QGroupBox)
+    QPushButton, QGridLayout, QProgressBar, QShortcut, QGroupBox, QComboBox)
 from PyQt5.QtGui import (
     QIcon, QPixmap, QPainter, QImage, QColor, QBrush, QPen,
     QKeySequence, QPalette)
 import numpy as np
 import cv2
+from annotated_images import (
+    IMAGE_FILENAME_PATTERN, ImagePack, annotated_image_filename,
+    read_encoded_image, video_identifier)
+
+
+class Profiler:
+    # Durations of named spans in the hot paths. Spans are only recorded
+    # when the profiler is enabled, otherwise they cost one attribute lookup.
+    # The last spans are kept for percentiles, all spans for a Chrome trace.
+    def __init__(self, history=500, max_events=1000000):
+        self.enabled = False
+        self.history = history
+        self.lock = threading.Lock()
+        self.durations = OrderedDict()
+        self.events = deque(maxlen=max_events)
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name, start, end):
+        with self.lock:
+            if name not in self.durations:
+                self.durations[name] = deque(maxlen=self.history)
+            self.durations[name].append(end - start)
+            self.events.append((name, start, end, threading.get_ident()))
+
+    def percentiles(self):
+        # median and 95th percentile of the last spans in milliseconds
+        with self.lock:
+            durations = [(name, list(spans))
+                         for name, spans in self.durations.items()]
+        return [(name, 1000.0 * np.percentile(spans, 50),
+                 1000.0 * np.percentile(spans, 95))
+                for name, spans in durations]
+
+    def export_chrome_trace(self, filename):
+        # can be opened with chrome://tracing or https://ui.perfetto.dev
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace_events = [
+            {"name": name, "ph": "X", "ts": 1e6 * start,
+             "dur": 1e6 * (end - start), "pid": pid, "tid": tid}
+            for name, start, end, tid in events]
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": trace_events}, f)
+
+
+class Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+
+
+def timed(name):
+    # records the duration of every call of the decorated function
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            with Span(PROFILER, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def gc_paused():
+    # the cyclic garbage collector would repeatedly traverse the many small
+    # objects created while filling large containers
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+NULL_SPAN = contextlib.nullcontext()
+PROFILER = Profiler()
 
 
 class MainWindow(QMainWindow):
     def __init__(self, args):
         super(MainWindow, self).__init__()
+        self.args = args
         self.central_widget = CentralWidget(self, args)
         self.setCentralWidget(self.central_widget)
         self.resize(1800, 800)  # TODO
         self.show()
 
+    def closeEvent(self, event):
+        self.central_widget.annotation.close()
+        if PROFILER.enabled and self.args.profile is not None:
+            PROFILER.export_chrome_trace(self.args.profile)
+        super(MainWindow, self).closeEvent(event)
+
 
 class CentralWidget(QWidget):
     def __init__(self, parent, args):
@@ -34,7 +145,9 @@ class CentralWidget(QWidget):
         self.setLayout(self.layout)
 
         self.annotator_config = AnnotatorConfigurationModel(args.config)
-        self.annotation = AnnotationModel(args.video, args.output, self.annotator_config)
+        self.annotation = AnnotationModel(
+            expand_video_filenames(args.video), args.output,
+            self.annotator_config)
 
         splitter = QSplitter(Qt.Horizontal)
 
@@ -153,10 +266,37 @@ class AnnotationEditor(QGroupBox):
         self.delete.pressed.connect(self.delete_selection)
         self.layout.addWidget(self.delete)
 
+        self.propagate = QPushButton(
+            "Propagate to Next %d Frames (P)"
+            % self.model.annotator_config.n_propagate_frames)
+        self.propagate.pressed.connect(self.propagate_annotations)
+        self.layout.addWidget(self.propagate)
+        self.model.propagator.propagated.connect(self.apply_propagated)
+
+        self.interpolate = QPushButton("Interpolate from Last Annotated Frame (I)")
+        self.interpolate.pressed.connect(self.interpolate_annotations)
+        self.layout.addWidget(self.interpolate)
+
+        self.accept = QPushButton("Accept Suggested Boxes (A)")
+        self.accept.pressed.connect(self.accept_suggestions)
+        self.layout.addWidget(self.accept)
+
+        self.accept_range = QPushButton(
+            "Accept Suggestions up to This Frame (Shift+A)")
+        self.accept_range.pressed.connect(self.accept_suggested_range)
+        self.layout.addWidget(self.accept_range)
+
         self.save = QPushButton("Save Annotations (Ctrl+s)")
         self.save.pressed.connect(self.save_annotations)
         self.layout.addWidget(self.save)
 
+        self.write_progress = QProgressBar()
+        self.write_progress.setFormat("Written %v / %m images")
+        self.write_progress.setRange(0, 1)
+        self.write_progress.setValue(1)
+        self.model.image_writer.progress.connect(self.update_write_progress)
+        self.layout.addWidget(self.write_progress)
+
         self.shortcut_select_prev = QShortcut(Qt.Key_Up, self)
         self.shortcut_select_prev.activated.connect(self.select_prev)
 
@@ -172,6 +312,18 @@ class AnnotationEditor(QGroupBox):
         self.shortcut_delete = QShortcut(Qt.Key_Delete, self)
         self.shortcut_delete.activated.connect(self.delete_selection)
 
+        self.shortcut_propagate = QShortcut(Qt.Key_P, self)
+        self.shortcut_propagate.activated.connect(self.propagate_annotations)
+
+        self.shortcut_interpolate = QShortcut(Qt.Key_I, self)
+        self.shortcut_interpolate.activated.connect(self.interpolate_annotations)
+
+        self.shortcut_accept = QShortcut(Qt.Key_A, self)
+        self.shortcut_accept.activated.connect(self.accept_suggestions)
+
+        self.shortcut_accept_range = QShortcut(QKeySequence("Shift+A"), self)
+        self.shortcut_accept_range.activated.connect(self.accept_suggested_range)
+
         self.shortcut_save = QShortcut(QKeySequence("Ctrl+s"), self)
         self.shortcut_save.activated.connect(self.save_annotations)
 
@@ -191,9 +343,32 @@ class AnnotationEditor(QGroupBox):
         self.model.delete_selection()
         self.image_view.update_annotation()
 
+    def propagate_annotations(self):
+        self.model.propagate()
+
+    def interpolate_annotations(self):
+        if self.model.interpolate():
+            self.image_view.update_annotation()
+
+    def accept_suggestions(self):
+        self.model.accept_suggestions()
+        self.image_view.update_annotation()
+
+    def accept_suggested_range(self):
+        self.model.accept_range()
+        self.image_view.update_annotation()
+
+    def apply_propagated(self, video_filename, frame_idx, boxes):
+        if self.model.apply_propagated(video_filename, frame_idx, boxes):
+            self.image_view.update_annotation()
+
     def save_annotations(self):
         self.model.save()
 
+    def update_write_progress(self, n_written, n_submitted):
+        self.write_progress.setRange(0, max(n_submitted, 1))
+        self.write_progress.setValue(n_written)
+
 
 class VideoControl(QGroupBox):
     def __init__(self, parent, annotation, image_view):
@@ -209,19 +384,14 @@ class VideoControl(QGroupBox):
         self.n_frames_label.setAlignment(Qt.AlignRight)
         self.layout.addWidget(self.n_frames_label, 0, 0, 1, 2)
 
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setTextVisible(False)
-        self.progress_bar.setRange(1, self.annotation.video_model.n_frames)
-        self.layout.addWidget(self.progress_bar, 1, 0, 1, 2)
-
-        fps = int(1.0 / self.annotation.video_model.secs_per_frame)
+        self.timeline = Timeline()
+        self.timeline.frame_selected.connect(self.jump_to_frame)
+        self.layout.addWidget(self.timeline, 1, 0, 1, 2)
 
         self.msecs_per_frame_label = QLabel()
-        self.msecs_per_frame_label.setText("%d FPS" % fps)
         self.layout.addWidget(self.msecs_per_frame_label, 2, 0)
 
         self.duration_label = QLabel()
-        self.duration_label.setText("%.3f s" % self.annotation.video_model.duration())
         self.layout.addWidget(self.duration_label, 2, 1)
 
         self.button_prev_image = QPushButton("Previous Frames")
@@ -232,31 +402,28 @@ class VideoControl(QGroupBox):
         self.button_next_image.pressed.connect(self.next_image)
         self.layout.addWidget(self.button_next_image, 3, 1)
 
-        frames_per_5_secs = fps * 5
-        self.button_skip5s = QPushButton("Skip %d Frames / 5s" % frames_per_5_secs)
-        self.button_skip5s.pressed.connect(partial(self.skip, frames_per_5_secs))
+        self.button_skip5s = QPushButton()
+        self.button_skip5s.pressed.connect(partial(self.skip_seconds, 5))
         self.layout.addWidget(self.button_skip5s, 4, 1)
 
-        self.button_back5s = QPushButton("Go back %d Frames / 5s" % frames_per_5_secs)
-        self.button_back5s.pressed.connect(partial(self.skip, -frames_per_5_secs))
+        self.button_back5s = QPushButton()
+        self.button_back5s.pressed.connect(partial(self.skip_seconds, -5))
         self.layout.addWidget(self.button_back5s, 4, 0)
 
-        frames_per_20_secs = fps * 20
-        self.button_skip20s = QPushButton("Skip %d Frames / 20s" % frames_per_20_secs)
-        self.button_skip20s.pressed.connect(partial(self.skip, frames_per_20_secs))
+        self.button_skip20s = QPushButton()
+        self.button_skip20s.pressed.connect(partial(self.skip_seconds, 20))
         self.layout.addWidget(self.button_skip20s, 5, 1)
 
-        self.button_back20s = QPushButton("Go back %d Frames / 20s" % frames_per_20_secs)
-        self.button_back20s.pressed.connect(partial(self.skip, -frames_per_20_secs))
+        self.button_back20s = QPushButton()
+        self.button_back20s.pressed.connect(partial(self.skip_seconds, -20))
         self.layout.addWidget(self.button_back20s, 5, 0)
 
-        frames_per_60_secs = fps * 60
-        self.button_skip60s = QPushButton("Skip %d Frames / 60s (+)" % frames_per_60_secs)
-        self.button_skip60s.pressed.connect(partial(self.skip, frames_per_60_secs))
+        self.button_skip60s = QPushButton()
+        self.button_skip60s.pressed.connect(partial(self.skip_seconds, 60))
         self.layout.addWidget(self.button_skip60s, 6, 1)
 
-        self.button_back60s = QPushButton("Go back %d Frames / 60s (-)" % frames_per_60_secs)
-        self.button_back60s.pressed.connect(partial(self.skip, -frames_per_60_secs))
+        self.button_back60s = QPushButton()
+        self.button_back60s.pressed.connect(partial(self.skip_seconds, -60))
         self.layout.addWidget(self.button_back60s, 6, 0)
 
         self.button_play = QPushButton("Play (Space)")
@@ -270,37 +437,123 @@ class VideoControl(QGroupBox):
         self.play_timer.timeout.connect(self.next_image)
         self.button_stop.pressed.connect(self.stop)
 
+        # frames from the low resolution proxy are replaced when the user
+        # pauses
+        self.full_quality_timer = QTimer(self)
+        self.full_quality_timer.setSingleShot(True)
+        self.full_quality_timer.setInterval(300)
+        self.full_quality_timer.timeout.connect(self.show_full_quality)
+
         self.shortcut_play_stop = QShortcut(Qt.Key_Space, self)
         self.shortcut_play_stop.activated.connect(self.toggle_play_stop)
 
         self.shortcut_skip1800 = QShortcut(Qt.Key_Plus, self)
-        self.shortcut_skip1800.activated.connect(partial(self.skip, frames_per_60_secs))
+        self.shortcut_skip1800.activated.connect(partial(self.skip_seconds, 60))
 
         self.shortcut_back1800 = QShortcut(Qt.Key_Minus, self)
-        self.shortcut_back1800.activated.connect(partial(self.skip, -frames_per_60_secs))
+        self.shortcut_back1800.activated.connect(partial(self.skip_seconds, -60))
+
+        self.button_next_distinct = QPushButton("Next Distinct Frame (N)")
+        self.button_next_distinct.pressed.connect(self.next_distinct_image)
+        self.layout.addWidget(self.button_next_distinct, 8, 0, 1, 2)
+
+        self.shortcut_next_distinct = QShortcut(Qt.Key_N, self)
+        self.shortcut_next_distinct.activated.connect(self.next_distinct_image)
+
+        if len(self.annotation.video_filenames) > 1:
+            self.video_selector = QComboBox()
+            self.video_selector.addItems(
+                [os.path.basename(filename)
+                 for filename in self.annotation.video_filenames])
+            self.video_selector.activated.connect(self.select_video)
+            self.layout.addWidget(self.video_selector, 9, 0, 1, 2)
+
+            self.button_prev_video = QPushButton("Previous Video (Page Up)")
+            self.button_prev_video.pressed.connect(partial(self.skip_videos, -1))
+            self.layout.addWidget(self.button_prev_video, 10, 0)
+
+            self.button_next_video = QPushButton("Next Video (Page Down)")
+            self.button_next_video.pressed.connect(partial(self.skip_videos, 1))
+            self.layout.addWidget(self.button_next_video, 10, 1)
+
+            self.shortcut_prev_video = QShortcut(Qt.Key_PageUp, self)
+            self.shortcut_prev_video.activated.connect(partial(self.skip_videos, -1))
+
+            self.shortcut_next_video = QShortcut(Qt.Key_PageDown, self)
+            self.shortcut_next_video.activated.connect(partial(self.skip_videos, 1))
+
+        if PROFILER.enabled:
+            self.timings = QLabel()
+            self.timings.setStyleSheet("font-family: monospace")
+            self.layout.addWidget(self.timings, 11, 0, 1, 2)
+            self.timings_timer = QTimer(self)
+            self.timings_timer.setInterval(500)
+            self.timings_timer.timeout.connect(self.update_timings)
+            self.timings_timer.start()
 
         self.playing = False
 
-        self.update_info()
+        self.update_video()
 
     def next_image(self):
-        update_required = self.annotation.next_image()
+        update_required = self.annotation.next_image(preview=self.playing)
         if not update_required:
             if self.playing:
                 self.stop()
             return
+        if self.playing:
+            self.full_quality_timer.start()
+        self.image_view.update_image()
+        self.image_view.update_annotation()
+        self.update_info()
+
+    def skip(self, frames, preview=False):
+        update_required = self.annotation.skip(frames, preview)
+        if not update_required:
+            return
+        if preview:
+            self.full_quality_timer.start()
         self.image_view.update_image()
         self.image_view.update_annotation()
         self.update_info()
 
-    def skip(self, frames):
-        update_required = self.annotation.skip(frames)
+    def skip_seconds(self, seconds):
+        self.skip(self._fps() * seconds, preview=True)
+
+    def show_full_quality(self):
+        if self.playing:
+            return
+        if self.annotation.video_model.load_full_quality():
+            self.image_view.update_image()
+
+    def jump_to_frame(self, frame_idx):
+        # the thumbnail is shown while the frame is decoded
+        thumbnail = self.annotation.video_model.thumbnails.thumbnail(frame_idx)
+        if thumbnail is not None:
+            self.image_view.show_preview(thumbnail)
+        self.skip(frame_idx - self.annotation.image_idx)
+
+    def next_distinct_image(self):
+        update_required = self.annotation.next_distinct_image()
         if not update_required:
             return
         self.image_view.update_image()
         self.image_view.update_annotation()
         self.update_info()
 
+    def select_video(self, video_idx):
+        if self.playing:
+            self.stop()
+        update_required = self.annotation.select_video(video_idx)
+        if not update_required:
+            return
+        self.image_view.update_image()
+        self.image_view.update_annotation()
+        self.update_video()
+
+    def skip_videos(self, n_videos):
+        self.select_video(self.annotation.video_idx + n_videos)
+
     def play(self):
         self.play_timer.start()
         self.playing = True
@@ -316,11 +569,116 @@ class VideoControl(QGroupBox):
             self.play_timer.start()
         self.playing = not self.playing
 
+    def _fps(self):
+        return int(1.0 / self.annotation.video_model.secs_per_frame)
+
+    def update_video(self):
+        video_model = self.annotation.video_model
+        fps = self._fps()
+        self.timeline.set_video(video_model.thumbnails, video_model.n_frames)
+        self.msecs_per_frame_label.setText("%d FPS" % fps)
+        self.duration_label.setText("%.3f s" % video_model.duration())
+        self.button_skip5s.setText("Skip %d Frames / 5s" % (fps * 5))
+        self.button_back5s.setText("Go back %d Frames / 5s" % (fps * 5))
+        self.button_skip20s.setText("Skip %d Frames / 20s" % (fps * 20))
+        self.button_back20s.setText("Go back %d Frames / 20s" % (fps * 20))
+        self.button_skip60s.setText("Skip %d Frames / 60s (+)" % (fps * 60))
+        self.button_back60s.setText("Go back %d Frames / 60s (-)" % (fps * 60))
+        self.play_timer.setInterval(int(1000.0 * video_model.secs_per_frame))
+        if len(self.annotation.video_filenames) > 1:
+            self.video_selector.setCurrentIndex(self.annotation.video_idx)
+        self.update_info()
+
+    def update_timings(self):
+        self.timings.setText("\n".join(
+            "%-50s p50 %7.2f ms p95 %7.2f ms" % timing
+            for timing in PROFILER.percentiles()))
+
     def update_info(self):
         self.n_frames_label.setText(
             "%d / %d Frames" % (self.annotation.video_model.frame_idx + 1,
                                 self.annotation.video_model.n_frames))
-        self.progress_bar.setValue(self.annotation.video_model.frame_idx + 1)
+        self.timeline.set_box_counts(self.annotation.box_counts())
+        self.timeline.set_position(self.annotation.video_model.frame_idx)
+
+
+class Timeline(QWidget):
+    # Thumbnails of the video with the number of annotated boxes per frame
+    # as a heatmap below and the current position. Clicking on it selects
+    # the corresponding frame.
+    frame_selected = pyqtSignal(int)
+    HEATMAP_HEIGHT = 10
+    N_BINS = 1024
+
+    def __init__(self):
+        super(Timeline, self).__init__()
+        self.thumbnails = None
+        self.n_frames = 1
+        self.frame_idx = 0
+        self.box_counts = None
+        self.heatmap = None
+
+    def set_video(self, thumbnails, n_frames):
+        self.thumbnails = thumbnails
+        self.n_frames = max(n_frames, 1)
+        self.box_counts = None
+        self.setFixedHeight(thumbnails.size[1] + self.HEATMAP_HEIGHT)
+        self.update()
+
+    def set_box_counts(self, box_counts):
+        if box_counts is self.box_counts or len(box_counts) == 0:
+            return
+        self.box_counts = box_counts
+        # mean number of boxes per frame in each bin
+        edges = np.linspace(
+            0, len(box_counts), min(len(box_counts), self.N_BINS) + 1).astype(int)
+        density = np.add.reduceat(box_counts, edges[:-1]) / np.diff(edges)
+        density = density / max(density.max(), 1.0)
+        self.heatmap_data = np.zeros((1, len(density), 4), dtype=np.uint8)
+        self.heatmap_data[0, :, 0] = 255
+        self.heatmap_data[0, :, 3] = np.round(255 * density)
+        self.heatmap = QImage(
+            self.heatmap_data.data, len(density), 1, 4 * len(density),
+            QImage.Format_RGBA8888)
+        self.update()
+
+    def set_position(self, frame_idx):
+        self.frame_idx = frame_idx
+        self.update()
+
+    def paintEvent(self, ev):
+        painter = QPainter(self)
+        width = self.width()
+        if self.thumbnails is not None:
+            thumbnail_width, thumbnail_height = self.thumbnails.size
+            n_thumbnails = max(width // thumbnail_width, 1)
+            for i in range(n_thumbnails):
+                left = i * width // n_thumbnails
+                right = (i + 1) * width // n_thumbnails
+                thumbnail = self.thumbnails.thumbnail(
+                    int((i + 0.5) * self.n_frames / n_thumbnails))
+                if thumbnail is None:
+                    continue
+                image = QImage(
+                    thumbnail.data, thumbnail_width, thumbnail_height,
+                    3 * thumbnail_width, QImage.Format_RGB888).rgbSwapped()
+                painter.drawImage(
+                    QRect(left, 0, right - left, thumbnail_height), image)
+        painter.fillRect(
+            QRect(0, self.height() - self.HEATMAP_HEIGHT, width,
+                  self.HEATMAP_HEIGHT), Qt.lightGray)
+        if self.heatmap is not None:
+            painter.drawImage(
+                QRect(0, self.height() - self.HEATMAP_HEIGHT, width,
+                      self.HEATMAP_HEIGHT), self.heatmap)
+        x = int(self.frame_idx * width / self.n_frames)
+        painter.setPen(QPen(Qt.red, 2))
+        painter.drawLine(x, 0, x, self.height())
+        painter.end()
+
+    def mousePressEvent(self, ev):
+        frame_idx = int(ev.pos().x() * self.n_frames / max(self.width(), 1))
+        self.frame_selected.emit(min(max(frame_idx, 0), self.n_frames - 1))
 
 
 class ImageCanvas(QGroupBox):
@@ -335,7 +693,7 @@ class ImageCanvas(QGroupBox):
 
         self.setWindowTitle("Image annotator")
 
-        self.img_view = ImageView()
+        self.img_view = ImageView(self.config.image_size)
         self.img_view.start_drag.connect(self.start_drag)
         self.img_view.drag.connect(self.drag)
         self.img_view.stop_drag.connect(self.stop_drag)
@@ -345,7 +703,8 @@ class ImageCanvas(QGroupBox):
         self.started_drag = None
         self.overlay = QImage(
             self.config.image_size[0], self.config.image_size[1],
-            QImage.Format_ARGB32)
+            QImage.Format_ARGB32_Premultiplied)
+        self.img_view.set_overlay(self.overlay)
 
         self.update_image()
         self.update_annotation()
@@ -354,34 +713,49 @@ class ImageCanvas(QGroupBox):
         self.started_drag = self._apply_bounds(x, y)
 
     def drag(self, x, y):
-        self._reset_overlay()
         x, y = self._apply_bounds(x, y)
-
-        painter = QPainter()
-        painter.begin(self.overlay)
-        self._paint_bbs(painter)
-        self._draw_rect(
-            painter, self.started_drag, (x, y), self.config.active_color,
-            selected=False)
-        painter.end()
-
-        self._apply_and_show_overlay()
+        # only the rubber band changes, the boxes in the overlay stay
+        self.img_view.set_rubber_band(
+            QRect(QPoint(*self.started_drag), QPoint(x, y)),
+            self._pen(self.config.active_color, selected=False))
 
     def stop_drag(self, x, y):
-        self.annotation.bounding_boxes.append(
-            [self.started_drag, self._apply_bounds(x, y), self.config.active_color])
+        self.annotation.add_box(
+            self.started_drag, self._apply_bounds(x, y), self.config.active_color)
         self.started_drag = None
+        self.img_view.clear_rubber_band()
+        self.update_annotation()
 
     def _apply_bounds(self, x, y):
-        return min(max(x, 0), self.img.width()), min(max(y, 0), self.img.height())
+        return (min(max(x, 0), self.config.image_size[0]),
+                min(max(y, 0), self.config.image_size[1]))
 
+    @timed("ImageCanvas.update_image")
     def update_image(self):
         data = self.annotation.video_model.image
-        # TODO can we reuse the image from previous frames?
-        self.original_img = QImage(
+        if hasattr(QImage, "Format_BGR888"):  # Qt >= 5.14
+            image = QImage(
+                data.data, data.shape[1], data.shape[0], 3 * data.shape[1],
+                QImage.Format_BGR888)
+        else:
+            image = QImage(
+                data.data, data.shape[1], data.shape[0], 3 * data.shape[1],
+                QImage.Format_RGB888).rgbSwapped()
+        # the frame is converted once and only drawn afterwards
+        self.img_view.set_image(QPixmap.fromImage(image))
+
+    def show_preview(self, thumbnail):
+        # shows an upscaled thumbnail without boxes immediately
+        data = np.ascontiguousarray(
+            cv2.resize(thumbnail, self.config.image_size)[:, :, ::-1])
+        image = QImage(
             data.data, data.shape[1], data.shape[0], 3 * data.shape[1],
-            QImage.Format_RGB888).rgbSwapped()
+            QImage.Format_RGB888)
+        self.img_view.set_image(QPixmap.fromImage(image))
+        self._reset_overlay()
+        self.img_view.repaint()
 
+    @timed("ImageCanvas.update_annotation")
     def update_annotation(self):
         self._reset_overlay()
         painter = QPainter()
@@ -392,42 +766,91 @@ class ImageCanvas(QGroupBox):
 
     def _paint_bbs(self, painter):
         i = 0
-        for topleft, bottomright, color in self.annotation.bounding_boxes:
+        for topleft, bottomright, color, _, reviewed in self.annotation.bounding_boxes:
             self._draw_rect(
                 painter, topleft, bottomright, color,
-                selected=self.annotation.selected_annotation == i)
+                selected=self.annotation.selected_annotation == i,
+                reviewed=reviewed)
             i += 1
 
-    def _draw_rect(self, painter, topleft, bottomright, color, selected=False):
-        width = 10 if selected else 5
-        painter.setPen(QPen(QBrush(self.config.bb_colors[color]), width))
+    def _draw_rect(self, painter, topleft, bottomright, color, selected=False,
+                   reviewed=True):
+        painter.setPen(self._pen(color, selected, reviewed))
         painter.drawRect(QRect(QPoint(*topleft), QPoint(*bottomright)))
 
+    def _pen(self, color, selected, reviewed=True):
+        width = 10 if selected else 5
+        pen = QPen(QBrush(self.config.bb_colors[color]), width)
+        if not reviewed:  # suggested boxes are dashed
+            pen.setStyle(Qt.DashLine)
+        return pen
+
     def _reset_overlay(self):
-        self.overlay.fill(QColor(255, 255, 255, 0))
+        self.overlay.fill(Qt.transparent)
 
+    @timed("ImageCanvas._apply_and_show_overlay")
     def _apply_and_show_overlay(self):
-        self.img = self.original_img.copy()
-
-        painter = QPainter()
-        painter.begin(self.img)
-        painter.drawImage(0, 0, self.overlay)
-        painter.end()
+        self.img_view.update()
 
-        self.img_view.setPixmap(QPixmap.fromImage(self.img))
 
-
-class ImageView(QLabel):
-    def __init__(self):
+class ImageView(QWidget):
+    # Paints three layers: the video frame, an overlay with all bounding
+    # boxes and the rubber band of the box that is currently drawn. Moving
+    # the rubber band only repaints the region that it covers.
+    def __init__(self, image_size):
         super(ImageView, self).__init__()
-    
+        self.setFixedSize(*image_size)
+        self.setAttribute(Qt.WA_OpaquePaintEvent)
+        self.pixmap = None
+        self.overlay = None
+        self.rubber_band = None
+        self.rubber_band_pen = None
+
     start_drag = pyqtSignal(int, int)
     drag = pyqtSignal(int, int)
     stop_drag = pyqtSignal(int, int)
 
+    def set_image(self, pixmap):
+        self.pixmap = pixmap
+        self.update()
+
+    def set_overlay(self, overlay):
+        self.overlay = overlay
+        self.update()
+
+    def set_rubber_band(self, rect, pen):
+        dirty = self._rubber_band_region()
+        self.rubber_band = rect.normalized()
+        self.rubber_band_pen = pen
+        self.update(dirty.united(self._rubber_band_region()))
+
+    def clear_rubber_band(self):
+        dirty = self._rubber_band_region()
+        self.rubber_band = None
+        self.update(dirty)
+
+    def _rubber_band_region(self):
+        if self.rubber_band is None:
+            return QRect()
+        width = int(self.rubber_band_pen.widthF()) + 1
+        return self.rubber_band.adjusted(-width, -width, width, width)
+
+    @timed("ImageView.paintEvent")
+    def paintEvent(self, ev):
+        rect = ev.rect()
+        painter = QPainter(self)
+        if self.pixmap is not None:
+            painter.drawPixmap(rect, self.pixmap, rect)
+        if self.overlay is not None:
+            painter.drawImage(rect, self.overlay, rect)
+        if self.rubber_band is not None:
+            painter.setPen(self.rubber_band_pen)
+            painter.drawRect(self.rubber_band)
+        painter.end()
+
     def mousePressEvent(self, ev):
         self.start_drag.emit(ev.pos().x(), ev.pos().y())
-    
+
     def mouseMoveEvent(self, ev):
         self.drag.emit(ev.pos().x(), ev.pos().y())
 
@@ -445,10 +868,72 @@ class AnnotatorConfigurationModel:
             if "classes" not in config:
                 raise Exception("Could not find class names")
 
-        # TODO validate values
-        self.n_classes = len(config["classes"])
         self.classes = config["classes"]
-        self.image_size = tuple(config["resolution"])
+        if not isinstance(self.classes, list) or len(self.classes) == 0:
+            raise Exception("At least one class name must be given")
+        self.n_classes = len(self.classes)
+        self.image_size = tuple(config.get("resolution", ()))
+        if (len(self.image_size) != 2 or
+                not all(isinstance(size, int) and size > 0
+                        for size in self.image_size)):
+            raise Exception("Resolution must be given as width and height "
+                            "in pixels")
+        self.n_prefetch_frames = config.get("prefetch_frames", 30)
+        if self.n_prefetch_frames < 1:
+            raise Exception("At least one frame must be prefetched")
+        self.frame_cache_mb = config.get("frame_cache_mb", 256)
+        if self.frame_cache_mb < 0:
+            raise Exception("Size of frame cache must not be negative")
+        self.image_format = config.get("image_format", "jpg")
+        if self.image_format not in ImageWriter.FORMATS:
+            raise Exception("Unknown image format '%s', available formats: %s"
+                            % (self.image_format, ", ".join(ImageWriter.FORMATS)))
+        self.image_quality = config.get("image_quality", 95)
+        if not 0 <= self.image_quality <= 100:
+            raise Exception("Image quality must be between 0 and 100")
+        self.n_writer_threads = config.get("writer_threads", 4)
+        if self.n_writer_threads < 1:
+            raise Exception("At least one thread must write images")
+        self.frame_buffer_mb = config.get("frame_buffer_mb", 256)
+        if self.frame_buffer_mb < 0:
+            raise Exception("Size of frame buffer must not be negative")
+        self.image_storage = config.get("image_storage", "files")
+        if self.image_storage not in ImageWriter.STORAGES:
+            raise Exception("Unknown image storage '%s', available storages: %s"
+                            % (self.image_storage, ", ".join(ImageWriter.STORAGES)))
+        self.pack_shard_mb = config.get("pack_shard_mb", 1024)
+        if self.pack_shard_mb < 1:
+            raise Exception("Tar files of packed images must be at least 1 MB")
+        self.max_open_videos = config.get("max_open_videos", 4)
+        if self.max_open_videos < 1:
+            raise Exception("At least one video must be open")
+        self.n_propagate_frames = config.get("propagate_frames", 30)
+        if self.n_propagate_frames < 1:
+            raise Exception("Boxes must be propagated to at least one frame")
+        self.tracker = config.get("tracker", "csrt")
+        if self.tracker not in BoxPropagator.TRACKERS:
+            raise Exception("Unknown tracker '%s', available trackers: %s"
+                            % (self.tracker, ", ".join(BoxPropagator.TRACKERS)))
+        if (self.tracker != "optical_flow" and
+                BoxPropagator.tracker_factory(self.tracker) is None):
+            warnings.warn("OpenCV does not come with the tracker '%s', boxes "
+                          "are tracked by optical flow." % self.tracker)
+            self.tracker = "optical_flow"
+        self.distinct_frame_threshold = config.get("distinct_frame_threshold", 10)
+        if not 0 <= self.distinct_frame_threshold < 64:
+            raise Exception("Threshold for distinct frames must be between 0 "
+                            "and 63 bits")
+        self.thumbnail_width = config.get("thumbnail_width", 64)
+        if self.thumbnail_width < 9:
+            raise Exception("Thumbnails must be at least 9 pixels wide")
+        self.proxy_width = config.get("proxy_width", 0)
+        if self.proxy_width < 0:
+            raise Exception("Width of proxy video must not be negative")
+        self.annotation_format = config.get("annotation_format", "csv")
+        if self.annotation_format not in AnnotationStore.FORMATS:
+            raise Exception(
+                "Unknown annotation format '%s', available formats: %s"
+                % (self.annotation_format, ", ".join(AnnotationStore.FORMATS)))
 
         self.bb_colors = [
             QColor(30, 45, 69),
@@ -474,70 +959,312 @@ class AnnotatorConfigurationModel:
 
 
 class AnnotationModel:
-    def __init__(self, filename, output_path, annotator_config):
-        self.video_model = VideoModel(filename, annotator_config.image_size)
+    def __init__(self, filenames, output_path, annotator_config):
         self.output_path = output_path
         self.annotator_config = annotator_config
         self.image_idx = -1
         self.image_filename = None
         if not os.path.exists(self.output_path):
             os.makedirs(self.output_path)
+        pack = None
+        if annotator_config.image_storage == "packed":
+            pack = ImagePack(
+                self.output_path, shard_mb=annotator_config.pack_shard_mb)
+        self.image_writer = ImageWriter(
+            annotator_config.image_format, annotator_config.image_quality,
+            annotator_config.n_writer_threads,
+            annotator_config.frame_buffer_mb, pack)
+        # videos are opened when they are selected, only the most recently
+        # used videos stay open
+        self.video_filenames = list(filenames)
+        self.video_identifiers = {}
+        self.video_models = OrderedDict()
+        self.video_positions = {}
+        self.video_idx = 0
         self.annotations_filename = os.path.join(
-            self.output_path, "annotations.csv")
+            self.output_path, "annotations." + annotator_config.annotation_format)
         self.load()
+        self.journal = AnnotationJournal(
+            os.path.join(self.output_path, "annotations.journal"))
+        self.missing_images = self._recover()
+        self.next_track_id = self.store.max_track_id() + 1
+        self.compaction = None
+        self.propagator = BoxPropagator(
+            annotator_config.image_size, annotator_config.tracker)
+        self.cached_box_counts = (None, None, None)
         self.bounding_boxes = []
         self.next_image()
 
-    def next_image(self):
+    @property
+    def video_model(self):
+        video_model = self.video_models.get(self.video_idx)
+        if video_model is not None:
+            self.video_models.move_to_end(self.video_idx)
+            return video_model
+
+        video_model = VideoModel(
+            self.video_filenames[self.video_idx],
+            self.annotator_config.image_size,
+            self.annotator_config.n_prefetch_frames, self.output_path,
+            self.annotator_config.frame_cache_mb, self.image_writer,
+            self.annotator_config.thumbnail_width,
+            self.annotator_config.proxy_width)
+        frame_idx = self.video_positions.pop(self.video_idx, -1)
+        if frame_idx >= 0:
+            video_model.jump(frame_idx + 1)
+        self.video_models[self.video_idx] = video_model
+        while len(self.video_models) > self.annotator_config.max_open_videos:
+            video_idx, idle_video_model = self.video_models.popitem(last=False)
+            self.video_positions[video_idx] = idle_video_model.frame_idx
+            idle_video_model.close()
+        return video_model
+
+    def select_video(self, video_idx):
+        if (video_idx == self.video_idx or
+                not 0 <= video_idx < len(self.video_filenames)):
+            return False
+        self.reset_annotation()
+        self.video_idx = video_idx
+        if self.video_model.frame_idx < 0:
+            self.video_model.next_frame()
+        self.image_idx = self.video_model.frame_idx
+        self._update_image_filename()
+        self._load_annotation_of_current_image()
+        return True
+
+    @timed("AnnotationModel.next_image")
+    def next_image(self, preview=False):
         self.reset_annotation()
         last_frame_idx = self.image_idx
-        self.image_idx = self.video_model.next_frame()
+        self.image_idx = self.video_model.next_frame(preview)
         self._update_image_filename()
         self._load_annotation_of_current_image()
         return last_frame_idx != self.image_idx
 
-    def skip(self, skip_frames):
+    @timed("AnnotationModel.skip")
+    def skip(self, skip_frames, preview=False):
         self.reset_annotation()
         last_frame_idx = self.image_idx
-        self.image_idx = self.video_model.jump(skip_frames)
+        self.image_idx = self.video_model.jump(skip_frames, preview)
         self._update_image_filename()
         self._load_annotation_of_current_image()
         return last_frame_idx != self.image_idx
 
+    def next_distinct_image(self):
+        # skips frames that look like the last annotated frame up to the
+        # current frame
+        reference_idx = self.image_idx
+        if len(self.bounding_boxes) == 0:
+            previous_idx = self.store.video_frames(self._video_identifier(
+                self.video_filenames[self.video_idx])).previous(self.image_idx)
+            if previous_idx is not None:
+                reference_idx = previous_idx
+        frame_idx = self.video_model.thumbnails.next_distinct_frame(
+            reference_idx, self.image_idx,
+            self.annotator_config.distinct_frame_threshold)
+        if frame_idx is None:
+            if not self.video_model.thumbnails.complete:
+                warnings.warn("Thumbnails are still being computed.")
+            return False
+        return self.skip(frame_idx - self.image_idx)
+
+    def box_counts(self):
+        # number of boxes per frame of the current video, only copied from
+        # the store when annotations changed
+        video_idx, version, box_counts = self.cached_box_counts
+        if video_idx == self.video_idx and version == self.store.version:
+            return box_counts
+        box_counts = np.zeros(self.video_model.n_frames, dtype=np.int32)
+        annotated_box_counts = self.store.video_frames(self._video_identifier(
+            self.video_filenames[self.video_idx])).box_counts
+        n_frames = min(len(box_counts), len(annotated_box_counts))
+        box_counts[:n_frames] = annotated_box_counts[:n_frames]
+        self.cached_box_counts = (self.video_idx, self.store.version, box_counts)
+        return box_counts
+
     def reset_annotation(self):
         self._save_annotations_as_rows()
         self.bounding_boxes = []
         self.selected_annotation = None
 
+    @timed("AnnotationModel._save_annotations_as_rows")
     def _save_annotations_as_rows(self):
-        self._remove_entries_from_this_image()
-        for bb in self.bounding_boxes:
-            x_min = min(bb[0][0], bb[1][0])
-            x_max = max(bb[0][0], bb[1][0])
-            y_min = min(bb[0][1], bb[1][1])
-            y_max = max(bb[0][1], bb[1][1])
-            row = (self.image_filename, self.image_idx,
-                   x_min, y_min, x_max, y_max, bb[2])
-            self.rows.append(row)
-
-        if (len(self.bounding_boxes) > 0 and
+        boxes = np.array(
+            [[min(bb[0][0], bb[1][0]), min(bb[0][1], bb[1][1]),
+              max(bb[0][0], bb[1][0]), max(bb[0][1], bb[1][1]), bb[2], bb[3],
+              bb[4]]
+             for bb in self.bounding_boxes], dtype=np.int32)
+        if self.image_filename is not None and not np.array_equal(
+                boxes.reshape(-1, AnnotationStore.N_COLUMNS),
+                self.store.get(self.image_filename, self.image_idx)):
+            self.store.replace(self.image_filename, self.image_idx, boxes)
+            self.journal.append(self.image_filename, self.image_idx, boxes)
+
+        # only frames with reviewed boxes are exported
+        if (any(bb[4] for bb in self.bounding_boxes) and
                 self.image_filename is not None and
-                not os.path.exists(self.image_filename)):
+                not self.image_writer.exists(self.image_filename)):
             self.video_model.buffer_frame(self.image_filename)
 
     def _update_image_filename(self):
-        m = hashlib.md5()
-        m.update(self.video_model.filename.encode())
-        identifier = m.hexdigest()
-        self.image_filename = os.path.join(
-            self.output_path,
-            "annotated_%s_%08d.jpg" % (identifier, self.image_idx))
-
+        self.image_filename = self._image_filename(self.image_idx)
+
+    def _image_filename(self, image_idx, video_filename=None):
+        # annotated frames keep the name of their image, even if the image
+        # format has been changed in the meantime
+        if video_filename is None:
+            video_filename = self.video_filenames[self.video_idx]
+        image_filename = self.store.video_frames(
+            self._video_identifier(video_filename)).image_filename(image_idx)
+        if image_filename is None:
+            image_filename = annotated_image_filename(
+                self.output_path, video_filename, image_idx,
+                self.image_writer.image_format)
+        return image_filename
+
+    def _video_identifier(self, video_filename):
+        identifier = self.video_identifiers.get(video_filename)
+        if identifier is None:
+            identifier = video_identifier(video_filename)
+            self.video_identifiers[video_filename] = identifier
+        return identifier
+
+    @timed("AnnotationModel._load_annotation_of_current_image")
     def _load_annotation_of_current_image(self):
-        for row in self.rows:
-            if row[0] == self.image_filename and row[1] == self.image_idx:
-                x_min, y_min, x_max, y_max, color = row[2:]
-                self.bounding_boxes.append([[x_min, y_min], [x_max, y_max], color])
+        boxes = self.store.get(self.image_filename, self.image_idx)
+        for x_min, y_min, x_max, y_max, color, track_id, reviewed in boxes.tolist():
+            self.bounding_boxes.append(
+                [[x_min, y_min], [x_max, y_max], color, track_id, reviewed])
+
+    def add_box(self, topleft, bottomright, color):
+        self.bounding_boxes.append(
+            [topleft, bottomright, color, self.next_track_id, 1])
+        self.next_track_id += 1
+
+    def accept_suggestions(self):
+        for bb in self.bounding_boxes:
+            bb[4] = 1
+
+    def accept_range(self):
+        # accepts the suggestions of the current frame and of the annotated
+        # frames directly before it up to a frame without suggestions, for
+        # example, all frames of an interpolation or propagation
+        self.accept_suggestions()
+        self._save_annotations_as_rows()
+        video_filename = self.video_filenames[self.video_idx]
+        video_frames = self.store.video_frames(
+            self._video_identifier(video_filename))
+        frame_idx = self.image_idx - 1
+        journal_rows = []
+        while video_frames.image_filename(frame_idx) is not None:
+            image_filename = video_frames.image_filename(frame_idx)
+            boxes = self.store.get(image_filename, frame_idx)
+            if np.all(boxes[:, 6] != 0):
+                break
+            boxes = boxes.copy()
+            boxes[:, 6] = 1
+            self.store.replace(image_filename, frame_idx, boxes)
+            journal_rows.append((image_filename, frame_idx, boxes))
+            self.missing_images.append((video_filename, frame_idx))
+            frame_idx -= 1
+        self.journal.extend(journal_rows)
+        return len(journal_rows)
+
+    def propagate(self):
+        self._save_annotations_as_rows()
+        boxes = self.store.get(self.image_filename, self.image_idx)
+        if len(boxes) == 0:
+            return
+        video_filename = self.video_filenames[self.video_idx]
+        self.video_model.load_full_quality()
+        self.propagator.start(
+            video_filename, self.image_idx, self.video_model.image, boxes,
+            self.annotator_config.n_propagate_frames,
+            self.video_model.keyframe_index)
+
+    def apply_propagated(self, video_filename, frame_idx, boxes):
+        # annotated frames are not overwritten
+        image_filename = self._image_filename(frame_idx, video_filename)
+        is_current = image_filename == self.image_filename
+        if is_current and len(self.bounding_boxes) > 0:
+            return False
+        if len(self.store.get(image_filename, frame_idx)) > 0:
+            return False
+        self.store.replace(image_filename, frame_idx, boxes)
+        self.journal.append(image_filename, frame_idx, boxes)
+        if is_current:
+            self._load_annotation_of_current_image()
+        return is_current
+
+    def interpolate(self):
+        # interpolates boxes linearly between the previous annotated frame
+        # and the current frame, boxes are matched by their track ID
+        self._save_annotations_as_rows()
+        boxes_b = self.store.get(self.image_filename, self.image_idx)
+        if len(boxes_b) == 0:
+            return False
+        frame_a = self.store.video_frames(self._video_identifier(
+            self.video_filenames[self.video_idx])).previous(self.image_idx)
+        if frame_a is None:
+            return False
+        boxes_a = self.store.get(self._image_filename(frame_a), frame_a)
+
+        boxes_b = self._match_tracks(boxes_a, boxes_b)
+        self.store.replace(self.image_filename, self.image_idx, boxes_b)
+        self.journal.append(self.image_filename, self.image_idx, boxes_b)
+        self.bounding_boxes = []
+        self._load_annotation_of_current_image()
+
+        track_ids = np.intersect1d(boxes_a[:, 5], boxes_b[:, 5])
+        boxes_a = boxes_a[np.argsort(boxes_a[:, 5])]
+        boxes_a = boxes_a[np.isin(boxes_a[:, 5], track_ids)]
+        boxes_b = boxes_b[np.argsort(boxes_b[:, 5])]
+        boxes_b = boxes_b[np.isin(boxes_b[:, 5], track_ids)]
+
+        frame_indices = np.arange(frame_a + 1, self.image_idx)
+        t = (frame_indices - frame_a) / float(self.image_idx - frame_a)
+        interpolated = np.empty(
+            (len(frame_indices), len(track_ids), AnnotationStore.N_COLUMNS),
+            dtype=np.int32)
+        interpolated[:, :, :4] = np.round(
+            boxes_a[np.newaxis, :, :4] + t[:, np.newaxis, np.newaxis] *
+            (boxes_b[np.newaxis, :, :4] - boxes_a[np.newaxis, :, :4]))
+        interpolated[:, :, 4:] = boxes_b[np.newaxis, :, 4:]
+        interpolated[:, :, 6] = 0
+
+        # Interpolated boxes are stored like all other boxes, so that
+        # suggestions can be reviewed and corrected per frame. Their images
+        # are written once they have been accepted, e.g., with accept_range.
+        # There are no annotated frames in between.
+        if len(track_ids) == 0:
+            return True
+        journal_rows = []
+        for frame_idx, boxes in zip(frame_indices.tolist(), interpolated):
+            image_filename = self._image_filename(frame_idx)
+            self.store.replace(image_filename, frame_idx, boxes)
+            journal_rows.append((image_filename, frame_idx, boxes))
+        self.journal.extend(journal_rows)
+        return True
+
+    def _match_tracks(self, boxes_a, boxes_b):
+        # boxes of b without a track in a get the track ID of the closest
+        # unmatched box of a with the same class
+        boxes_b = boxes_b.copy()
+        unmatched_a = [i for i in range(len(boxes_a))
+                       if boxes_a[i, 5] not in boxes_b[:, 5]]
+        centers_a = (boxes_a[:, :2] + boxes_a[:, 2:4]) / 2.0
+        centers_b = (boxes_b[:, :2] + boxes_b[:, 2:4]) / 2.0
+        for j in range(len(boxes_b)):
+            if boxes_b[j, 5] in boxes_a[:, 5]:
+                continue
+            candidates = [i for i in unmatched_a if boxes_a[i, 4] == boxes_b[j, 4]]
+            if len(candidates) == 0:
+                continue
+            distances = np.linalg.norm(centers_a[candidates] - centers_b[j], axis=1)
+            i = candidates[int(np.argmin(distances))]
+            boxes_b[j, 5] = boxes_a[i, 5]
+            unmatched_a.remove(i)
+        return boxes_b
 
     def select_prev(self):
         if self.selected_annotation is None:
@@ -567,6 +1294,7 @@ class AnnotationModel:
         self.bounding_boxes[self.selected_annotation][2] = (
             (self.bounding_boxes[self.selected_annotation][2] + 1)
              % self.annotator_config.n_classes)
+        self.bounding_boxes[self.selected_annotation][4] = 1
 
     def delete_selection(self):
         if self.selected_annotation is None:
@@ -578,100 +1306,1647 @@ class AnnotationModel:
             self.selected_annotation = None
 
     def load(self):
+        self.store = AnnotationStore()
+        csv_filename = os.path.join(self.output_path, "annotations.csv")
         if os.path.exists(self.annotations_filename):
-            with open(self.annotations_filename, "r") as f:
-                annotations_reader = csv.reader(f, delimiter=",")
-                self.rows = [self._convert_row(r) for r in annotations_reader]
-        else:
-            self.rows = []
-
-    def _convert_row(self, row):
-        return [row[0]] + list(map(int, map(float, row[1:])))
-
-    def _remove_entries_from_this_image(self):
-        rows_to_delete = []
-        for row_idx in range(len(self.rows)):
-            if self.rows[row_idx][0] == self.image_filename and self.rows[row_idx][1] == self.image_idx:
-                rows_to_delete.append(self.rows[row_idx])
-        for row in rows_to_delete:  # TODO more efficient?
-            self.rows.remove(row)
-
+            self.store.load(self.annotations_filename)
+        elif os.path.exists(csv_filename):
+            self.store.load(csv_filename)
+        extension = "." + self.annotator_config.image_format
+        n_other_format = sum(
+            not image_filename.endswith(extension)
+            for image_filename, _ in self.store.frames)
+        if n_other_format > 0:
+            warnings.warn(
+                "Images of %d annotated frames have another format than %s, "
+                "they keep their format." % (
+                    n_other_format, self.annotator_config.image_format))
+
+    def _recover(self):
+        recovered_frames = self.journal.replay(self.store)
+        if len(recovered_frames) > 0:
+            warnings.warn("Recovered annotations of %d frames from unsaved "
+                          "session." % len(recovered_frames))
+        missing_images = []
+        for video_filename in self.video_filenames:
+            missing_images.extend(
+                (video_filename, image_idx)
+                for image_filename, image_idx in recovered_frames
+                if image_filename == self._image_filename(image_idx, video_filename))
+        return missing_images
+
+    @timed("AnnotationModel.save")
     def save(self):
-        if len(self.bounding_boxes) > 0 and not os.path.exists(self.image_filename):
-            self.video_model.buffer_frame(self.image_filename)
         self._save_annotations_as_rows()
-
+        self._write_missing_images()
         self.video_model.write_buffer()
+        self.journal.flush()
+        self.compact()
+
+    def _write_missing_images(self):
+        missing_images = OrderedDict()
+        for video_filename, image_idx in self.missing_images:
+            # only frames with reviewed boxes are exported
+            image_filename = self._image_filename(image_idx, video_filename)
+            if (np.any(self.store.get(image_filename, image_idx)[:, 6] != 0) and
+                    not self.image_writer.exists(image_filename)):
+                missing_images.setdefault(video_filename, []).append(image_idx)
+        for video_filename, image_indices in missing_images.items():
+            keyframe_index = KeyframeIndex(video_filename, os.path.join(
+                self.output_path,
+                "keyframes_%s.npz" % video_identifier(video_filename)),
+                build=False)
+            for image_idx, image in read_frames(
+                    video_filename, image_indices,
+                    self.annotator_config.image_size, keyframe_index):
+                self.image_writer.submit(
+                    self._image_filename(image_idx, video_filename), image)
+        self.missing_images = []
+
+    def compact(self, background=True):
+        if self.compaction is not None:
+            self.compaction.join()
+        segments = self.journal.rotate()
+        store = self.store.copy()
+        self.compaction = threading.Thread(
+            target=self._write_annotations, args=(store, segments))
+        self.compaction.start()
+        if not background:
+            self.compaction.join()
+
+    def _write_annotations(self, store, segments):
+        store.save(self.annotations_filename)
+        self.journal.remove(segments)
+
+    def close(self):
+        self.propagator.stop()
+        self.save()
+        self.compaction.join()
+        self.journal.close()
+        for video_model in self.video_models.values():
+            video_model.close()
+        self.video_models.clear()
+        self.image_writer.close()
+
+
+class AnnotationStore:
+    # Bounding boxes indexed by image filename and frame index. The boxes of
+    # each frame are stored in an int32 array with the columns x_min, y_min,
+    # x_max, y_max, class, track ID and reviewed. Frames are kept in the order
+    # in which they have been annotated last. The track ID identifies the same
+    # object in different frames. Boxes that have been suggested by a tracker
+    # or a model are not reviewed until they are accepted or modified. Track
+    # ID and reviewed are not part of the CSV file and are stored in a
+    # separate file next to it.
+    N_COLUMNS = 7
+    FORMATS = ["csv", "npz"]
+
+    def __init__(self):
+        self.frames = OrderedDict()
+        self.videos = {}  # annotated frames per video identifier
+        self.n_boxes = 0
+        self.version = 0  # incremented on every change
+
+    def __len__(self):
+        return self.n_boxes
+
+    def get(self, image_filename, frame_idx):
+        boxes = self.frames.get((image_filename, frame_idx))
+        if boxes is None:
+            return np.empty((0, self.N_COLUMNS), dtype=np.int32)
+        return boxes
+
+    def replace(self, image_filename, frame_idx, boxes):
+        self.delete(image_filename, frame_idx)
+        if len(boxes) > 0:
+            boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, self.N_COLUMNS)
+            self.frames[(image_filename, frame_idx)] = boxes
+            self.n_boxes += len(boxes)
+            self.version += 1
+            match = IMAGE_FILENAME_PATTERN.search(image_filename)
+            if match is not None:
+                self.videos.setdefault(match.group(1), VideoFrames()).add(
+                    image_filename, frame_idx, len(boxes))
+
+    def delete(self, image_filename, frame_idx):
+        boxes = self.frames.pop((image_filename, frame_idx), None)
+        if boxes is not None:
+            self.n_boxes -= len(boxes)
+            self.version += 1
+            match = IMAGE_FILENAME_PATTERN.search(image_filename)
+            if match is not None:
+                self.videos[match.group(1)].remove(image_filename, frame_idx)
+
+    def video_frames(self, identifier):
+        video_frames = self.videos.get(identifier)
+        if video_frames is None:
+            return VideoFrames()
+        return video_frames
+
+    def rows(self):
+        for (image_filename, frame_idx), boxes in self.frames.items():
+            for box in boxes[:, :5].tolist():
+                yield [image_filename, frame_idx] + box
+
+    def max_track_id(self):
+        if len(self.frames) == 0:
+            return -1
+        return int(max(boxes[:, 5].max() for boxes in self.frames.values()))
+
+    def load(self, filename):
+        if filename.endswith(".npz"):
+            self.load_npz(filename)
+        else:
+            self.load_csv(filename)
+
+    def save(self, filename):
+        if filename.endswith(".npz"):
+            self.save_npz(filename)
+        else:
+            self.save_csv(filename)
+
+    @staticmethod
+    def stream(filename):
+        # Image filename, frame index and boxes of one frame after another
+        # without building a store. The rows of a frame are consecutive in
+        # files written by the store.
+        if filename.endswith(".npz"):
+            filenames, filename_idx, frame_idx, boxes = \
+                AnnotationStore._read_npz(filename)
+            starts = np.flatnonzero(
+                (filename_idx[1:] != filename_idx[:-1]) |
+                (frame_idx[1:] != frame_idx[:-1])) + 1
+            for start, end in zip(np.r_[0, starts].tolist(),
+                                  np.r_[starts, len(boxes)].tolist()):
+                yield (str(filenames[filename_idx[start]]),
+                       int(frame_idx[start]), boxes[start:end])
+            return
+
+        with open(filename, "r") as f:
+            n_rows = sum(1 for _ in csv.reader(f, delimiter=","))
+        attributes = AnnotationStore._read_attributes(filename, n_rows)
+        with open(filename, "r") as f:
+            key = None
+            boxes = []
+            for row_idx, row in enumerate(csv.reader(f, delimiter=",")):
+                row_key = (row[0], int(float(row[1])))
+                if row_key != key and len(boxes) > 0:
+                    yield key + (np.array(boxes, dtype=np.int32),)
+                    boxes = []
+                key = row_key
+                boxes.append(list(map(int, map(float, row[2:7])))
+                             + attributes[row_idx].tolist())
+            if len(boxes) > 0:
+                yield key + (np.array(boxes, dtype=np.int32),)
+
+    def load_npz(self, filename):
+        filenames, filename_idx, frame_idx, boxes = self._read_npz(filename)
+        if len(boxes) == 0:
+            return
+        with gc_paused():
+            self._fill(filenames, filename_idx, frame_idx, boxes)
+
+    @staticmethod
+    def _read_npz(filename):
+        # one entry per box: filename_idx refers to the list of filenames
+        with np.load(filename) as annotations:
+            filenames = annotations["filenames"]
+            filename_idx = annotations["filename_idx"]
+            frame_idx = annotations["frame_idx"]
+            if "track_ids" in annotations:
+                track_ids = annotations["track_ids"]
+            else:
+                track_ids = np.arange(len(frame_idx))
+            if "reviewed" in annotations:
+                reviewed = annotations["reviewed"]
+            else:
+                reviewed = np.ones(len(frame_idx))
+            boxes = np.column_stack(
+                (annotations["boxes"], annotations["classes"], track_ids,
+                 reviewed)).astype(np.int32)
+        return filenames, filename_idx, frame_idx, boxes
+
+    def _fill(self, filenames, filename_idx, frame_idx, boxes):
+        # boxes of a frame are stored consecutively
+        starts = np.flatnonzero(
+            (filename_idx[1:] != filename_idx[:-1]) |
+            (frame_idx[1:] != frame_idx[:-1])) + 1
+        first = np.r_[0, starts]
+        frame_filename_idx = filename_idx[first]
+        frame_indices = frame_idx[first]
+        keys = list(zip(filenames[frame_filename_idx].tolist(),
+                        frame_indices.tolist()))
+        if len(self.frames) > 0:
+            for (image_filename, idx), frame_boxes in zip(
+                    keys, np.split(boxes, starts)):
+                self.replace(image_filename, idx, frame_boxes)
+            return
 
-        with open(self.annotations_filename, "w") as f:
+        # an empty store is filled at once, np.split would be much slower
+        ends = np.r_[starts, len(boxes)]
+        self.frames = OrderedDict(zip(keys, [
+            boxes[start:end] for start, end in zip(first.tolist(), ends.tolist())]))
+        self.n_boxes = len(boxes)
+        self.version += 1
+        identifier_codes = {}
+        filename_codes = []
+        for image_filename in filenames.tolist():
+            match = IMAGE_FILENAME_PATTERN.search(image_filename)
+            identifier = None if match is None else match.group(1)
+            filename_codes.append(
+                identifier_codes.setdefault(identifier, len(identifier_codes)))
+        frame_codes = np.array(filename_codes)[frame_filename_idx]
+        box_counts = ends - first
+        for identifier, code in identifier_codes.items():
+            if identifier is None:
+                continue
+            in_video = frame_codes == code
+            self.videos[identifier] = VideoFrames.build(
+                filenames[frame_filename_idx[in_video]],
+                frame_indices[in_video], box_counts[in_video])
+
+    def save_npz(self, filename):
+        keys = list(self.frames.keys())
+        n_boxes_per_frame = [len(boxes) for boxes in self.frames.values()]
+        if len(keys) > 0:
+            boxes = np.concatenate(list(self.frames.values()))
+        else:
+            boxes = np.empty((0, self.N_COLUMNS), dtype=np.int32)
+        filenames, filename_idx = np.unique(
+            np.array([image_filename for image_filename, _ in keys], dtype=str),
+            return_inverse=True)
+        frame_idx = np.array([idx for _, idx in keys], dtype=np.int32)
+
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            np.savez(
+                f, filenames=filenames,
+                filename_idx=np.repeat(filename_idx.astype(np.int32),
+                                       n_boxes_per_frame),
+                frame_idx=np.repeat(frame_idx, n_boxes_per_frame),
+                boxes=boxes[:, :4], classes=boxes[:, 4], track_ids=boxes[:, 5],
+                reviewed=boxes[:, 6].astype(bool))
+        os.replace(tmp_filename, filename)
+
+    def load_csv(self, filename):
+        with open(filename, "r") as f:
+            annotations_reader = csv.reader(f, delimiter=",")
+            rows = [[row[0]] + list(map(int, map(float, row[1:7])))
+                    for row in annotations_reader]
+        attributes = self._read_attributes(filename, len(rows))
+        frames = OrderedDict()
+        for row, attribute in zip(rows, attributes.tolist()):
+            frames.setdefault((row[0], row[1]), []).append(row[2:] + attribute)
+        for (image_filename, frame_idx), boxes in frames.items():
+            self.replace(image_filename, frame_idx, boxes)
+
+    def save_csv(self, filename):
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "w") as f:
             annotations_writer = csv.writer(f, delimiter=",")
-            for row in self.rows:
-                annotations_writer.writerow(row)
+            annotations_writer.writerows(self.rows())
+        if len(self.frames) > 0:
+            attributes = np.concatenate(
+                [boxes[:, 5:] for boxes in self.frames.values()])
+        else:
+            attributes = np.empty((0, self.N_COLUMNS - 5), dtype=np.int32)
+        attributes_filename = self._attributes_filename(filename)
+        with open(attributes_filename + ".tmp", "wb") as f:
+            np.save(f, attributes)
+        # the CSV file is replaced first, an interruption in between leaves
+        # attributes that do not match and are ignored with a warning
+        os.replace(tmp_filename, filename)
+        os.replace(attributes_filename + ".tmp", attributes_filename)
+
+    @staticmethod
+    def _read_attributes(filename, n_rows):
+        # without a matching file, track IDs are numbered and boxes reviewed
+        attributes = None
+        attributes_filename = AnnotationStore._attributes_filename(filename)
+        if os.path.exists(attributes_filename):
+            attributes = np.load(attributes_filename)
+            if attributes.shape != (n_rows, AnnotationStore.N_COLUMNS - 5):
+                warnings.warn("Ignored %s, it does not match the rows of %s."
+                              % (attributes_filename, filename))
+                attributes = None
+        if attributes is None:
+            attributes = np.column_stack(
+                (np.arange(n_rows), np.ones(n_rows, dtype=int)))
+        return attributes
+
+    @staticmethod
+    def _attributes_filename(filename):
+        # track IDs and reviewed flags of the rows in the CSV file
+        return os.path.splitext(filename)[0] + "_attributes.npy"
+
+    def copy(self):
+        store = AnnotationStore()
+        store.frames = OrderedDict(self.frames)
+        store.videos = {identifier: video_frames.copy()
+                        for identifier, video_frames in self.videos.items()}
+        store.n_boxes = self.n_boxes
+        store.version = self.version
+        return store
+
+
+class VideoFrames:
+    # Image filenames of the annotated frames of one video by frame index,
+    # the sorted frame indices and the number of boxes per frame. The array
+    # of box counts grows with the largest annotated frame index.
+    def __init__(self):
+        self.filenames = {}
+        self.frame_indices = []
+        self.box_counts = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.frame_indices)
+
+    @staticmethod
+    def build(image_filenames, frame_indices, box_counts):
+        # index of annotated frames given as arrays, later entries replace
+        # earlier entries of the same frame
+        video_frames = VideoFrames()
+        video_frames.filenames = dict(zip(
+            frame_indices.tolist(), image_filenames.tolist()))
+        video_frames.frame_indices = sorted(video_frames.filenames)
+        if len(frame_indices) > 0:
+            video_frames.box_counts = np.zeros(
+                int(frame_indices.max()) + 1, dtype=np.int32)
+            video_frames.box_counts[frame_indices] = box_counts
+        return video_frames
+
+    def add(self, image_filename, frame_idx, n_boxes):
+        if frame_idx not in self.filenames:
+            bisect.insort(self.frame_indices, frame_idx)
+        self.filenames[frame_idx] = image_filename
+        if frame_idx >= len(self.box_counts):
+            box_counts = np.zeros(
+                max(2 * len(self.box_counts), frame_idx + 1), dtype=np.int32)
+            box_counts[:len(self.box_counts)] = self.box_counts
+            self.box_counts = box_counts
+        self.box_counts[frame_idx] = n_boxes
+
+    def remove(self, image_filename, frame_idx):
+        if self.filenames.get(frame_idx) != image_filename:
+            return
+        del self.filenames[frame_idx]
+        del self.frame_indices[
+            bisect.bisect_left(self.frame_indices, frame_idx)]
+        self.box_counts[frame_idx] = 0
+
+    def image_filename(self, frame_idx):
+        return self.filenames.get(frame_idx)
+
+    def previous(self, frame_idx):
+        # last annotated frame before frame_idx
+        i = bisect.bisect_left(self.frame_indices, frame_idx)
+        if i == 0:
+            return None
+        return self.frame_indices[i - 1]
+
+    def copy(self):
+        video_frames = VideoFrames()
+        video_frames.filenames = dict(self.filenames)
+        video_frames.frame_indices = list(self.frame_indices)
+        video_frames.box_counts = self.box_counts.copy()
+        return video_frames
+
+
+class AnnotationJournal:
+    # Append-only log of the boxes of frames that changed since annotations
+    # have been written to annotations.csv. Each line contains image filename,
+    # frame index and the flattened boxes of the frame. A new segment is
+    # started whenever the annotations are compacted so that older segments
+    # can be removed after the annotation file has been written.
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.file = None
+        segments = self.segments()
+        if len(segments) > 0:
+            self.segment_idx = int(segments[-1].rsplit(".", 1)[1]) + 1
+        else:
+            self.segment_idx = 0
+
+    def segments(self):
+        return sorted(glob.glob(glob.escape(self.prefix) + ".[0-9]*"))
+
+    def replay(self, store):
+        recovered_frames = OrderedDict()
+        for segment in self.segments():
+            with open(segment, "r", newline="") as f:
+                for line in f:
+                    if not line.endswith("\n"):  # incomplete last line
+                        break
+                    row = next(csv.reader([line], delimiter=","))
+                    image_filename, frame_idx = row[0], int(row[1])
+                    boxes = list(map(int, row[2:]))
+                    store.replace(image_filename, frame_idx, boxes)
+                    recovered_frames[(image_filename, frame_idx)] = None
+        return list(recovered_frames.keys())
+
+    def append(self, image_filename, frame_idx, boxes):
+        self.extend([(image_filename, frame_idx, boxes)])
+
+    def extend(self, frames):
+        if self.file is None:
+            self.file = open(
+                "%s.%08d" % (self.prefix, self.segment_idx), "a", newline="")
+            self.writer = csv.writer(self.file, delimiter=",")
+        self.writer.writerows(
+            [image_filename, frame_idx] + np.ravel(boxes).tolist()
+            for image_filename, frame_idx, boxes in frames)
+        self.file.flush()
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def rotate(self):
+        self.close()
+        self.segment_idx += 1
+        return [segment for segment in self.segments()
+                if int(segment.rsplit(".", 1)[1]) < self.segment_idx]
+
+    def remove(self, segments):
+        for segment in segments:
+            os.remove(segment)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class BoxPropagator(QObject):
+    # Tracks boxes of one frame through the following frames in a worker
+    # thread and reports the tracked boxes of each frame.
+    TRACKERS = {
+        "csrt": "TrackerCSRT_create",
+        "kcf": "TrackerKCF_create",
+        "optical_flow": None,
+    }
+
+    propagated = pyqtSignal(str, int, object)
+
+    def __init__(self, image_size, tracker="csrt"):
+        super(BoxPropagator, self).__init__()
+        self.image_size = image_size
+        self.tracker = tracker
+        self.thread = None
+        self.running = False
+
+    def start(self, video_filename, frame_idx, image, boxes, n_frames,
+              keyframe_index=None):
+        self.stop()
+        self.running = True
+        self.thread = threading.Thread(
+            target=self._propagate,
+            args=(video_filename, frame_idx, image, boxes, n_frames,
+                  keyframe_index))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _propagate(self, video_filename, frame_idx, image, boxes, n_frames,
+                   keyframe_index):
+        trackers = []
+        for box in boxes.tolist():
+            x_min, y_min, x_max, y_max = box[:4]
+            if x_max - x_min < 1 or y_max - y_min < 1:
+                continue
+            tracker = self._create_tracker()
+            tracker.init(image, (x_min, y_min, x_max - x_min, y_max - y_min))
+            trackers.append((tracker, box))
+
+        frames = read_frames(
+            video_filename, range(frame_idx + 1, frame_idx + n_frames + 1),
+            self.image_size, keyframe_index)
+        try:
+            for next_frame_idx, next_image in frames:
+                if not self.running or len(trackers) == 0:
+                    return
+                tracked = []
+                tracked_boxes = []
+                for tracker, box in trackers:
+                    success, (x, y, w, h) = tracker.update(next_image)
+                    if not success:
+                        continue
+                    x_min = int(round(min(max(x, 0), self.image_size[0])))
+                    y_min = int(round(min(max(y, 0), self.image_size[1])))
+                    x_max = int(round(min(max(x + w, 0), self.image_size[0])))
+                    y_max = int(round(min(max(y + h, 0), self.image_size[1])))
+                    if x_max - x_min < 1 or y_max - y_min < 1:
+                        continue
+                    tracked.append((tracker, box))
+                    tracked_boxes.append(
+                        [x_min, y_min, x_max, y_max] + box[4:6] + [0])
+                trackers = tracked
+                if len(tracked_boxes) > 0:
+                    self.propagated.emit(
+                        video_filename, next_frame_idx,
+                        np.array(tracked_boxes, dtype=np.int32))
+        finally:
+            frames.close()
+
+    @classmethod
+    def tracker_factory(cls, tracker):
+        # function that creates the tracker, None if OpenCV does not come
+        # with it
+        name = cls.TRACKERS[tracker]
+        for module in (cv2, getattr(cv2, "legacy", None)):
+            if name is not None and hasattr(module, name):
+                return getattr(module, name)
+        return None
+
+    def _create_tracker(self):
+        factory = self.tracker_factory(self.tracker)
+        if factory is None:
+            return OpticalFlowTracker()
+        return factory()
+
+
+class OpticalFlowTracker:
+    # Used if OpenCV does not come with the requested tracker. Moves the box
+    # by the median optical flow of corners inside of the box.
+    def init(self, image, bbox):
+        self.gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        self.bbox = tuple(map(float, bbox))
+
+    def update(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        x, y, w, h = self.bbox
+        mask = np.zeros_like(self.gray)
+        mask[max(int(y), 0):max(int(y + h), 0),
+             max(int(x), 0):max(int(x + w), 0)] = 255
+        points = cv2.goodFeaturesToTrack(
+            self.gray, maxCorners=50, qualityLevel=0.01, minDistance=3,
+            mask=mask)
+        if points is None:
+            return False, self.bbox
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.gray, gray, points, None)
+        found = status.ravel() == 1
+        if not np.any(found):
+            return False, self.bbox
+        dx, dy = np.median(next_points[found] - points[found], axis=0).ravel()
+        self.bbox = (x + dx, y + dy, w, h)
+        self.gray = gray
+        return True, self.bbox
 
 
 class VideoModel:
-    def __init__(self, filename, image_size):
+    def __init__(self, filename, image_size, n_prefetch_frames=30,
+                 cache_path=None, frame_cache_mb=256, image_writer=None,
+                 thumbnail_width=64, proxy_width=0):
         self.filename = filename
         self.image_size = image_size
         self.cap = cv2.VideoCapture(self.filename)
-        self.n_frames = self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        self.n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self.secs_per_frame = 1.0 / self.cap.get(cv2.CAP_PROP_FPS)
         self.frame_idx = -1
-        self.frame_buffer = {}
-        # TODO VideoCapture.release() on shutdown
+        if image_writer is None:
+            image_writer = ImageWriter()
+        self.image_writer = image_writer
+        self.frame_cache = FrameCache(frame_cache_mb * 1024 ** 2)
+        if cache_path is None:
+            index_filename = None
+        else:
+            index_filename = os.path.join(
+                cache_path, "keyframes_%s.npz" % video_identifier(filename))
+        self.keyframe_index = KeyframeIndex(self.filename, index_filename)
+        if cache_path is None:
+            thumbnails_prefix = None
+        else:
+            thumbnails_prefix = os.path.join(
+                cache_path, "thumbnails_%s" % video_identifier(filename))
+        thumbnail_size = (thumbnail_width, max(
+            int(round(thumbnail_width * image_size[1] / float(image_size[0]))), 8))
+        self.thumbnails = ThumbnailCache(
+            self.filename, self.n_frames, thumbnail_size, thumbnails_prefix,
+            build=False)
+        # thumbnails are computed while the proxy is transcoded
+        self.proxy = None
+        if proxy_width > 0 and cache_path is not None:
+            proxy_size = (proxy_width, int(round(
+                proxy_width * image_size[1] / float(image_size[0]))))
+            self.proxy = ProxyVideo(self.filename, proxy_size, os.path.join(
+                cache_path, "proxy_%s" % video_identifier(filename)),
+                self.thumbnails)
+        if self.proxy is None or self.proxy.thread is None:
+            self.thumbnails.start()
+        self.is_preview = False
+        self.prefetcher = FramePrefetcher(
+            self.cap, self.image_size, n_prefetch_frames, self.keyframe_index)
+        self.prefetcher.start()
 
     def duration(self):
         return self.n_frames * self.secs_per_frame
 
-    def next_frame(self):
+    def next_frame(self, preview=False):
         self.frame_idx += 1
-        success = self._read_image()
+        success = self._read_image(preview)
         if not success:
             self.frame_idx -= 1
         return self.frame_idx
 
-    def jump(self, skip_frames):
+    def jump(self, skip_frames, preview=False):
         last_frame_idx = self.frame_idx
         self.frame_idx += skip_frames
         if self.frame_idx >= self.n_frames:
             self.frame_idx = self.n_frames - 1
         elif self.frame_idx < 0:
             self.frame_idx = 0
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frame_idx)
 
-        success = self._read_image()
+        success = self._read_image(preview)
         if not success:
             self.frame_idx = last_frame_idx
         return self.frame_idx
 
-    def _read_image(self):
-        assert self.cap.isOpened()
-        success, image = self.cap.read()
-        if success:
-            self.image = cv2.resize(image, self.image_size)
-        return success
+    @timed("VideoModel._read_image")
+    def _read_image(self, preview=False):
+        # previews are upscaled frames of the proxy, they are not cached
+        image = self.frame_cache.get(self.frame_idx)
+        is_preview = False
+        if image is None and preview and self.proxy is not None:
+            image = self.proxy.frame(self.frame_idx)
+            if image is not None:
+                image = cv2.resize(image, self.image_size)
+                is_preview = True
+        if image is None:
+            image = self.prefetcher.frame(self.frame_idx)
+            if image is None:
+                return False
+            self.frame_cache.put(self.frame_idx, image)
+        self.image = image
+        self.is_preview = is_preview
+        return True
+
+    def load_full_quality(self):
+        if not self.is_preview:
+            return False
+        return self._read_image()
 
     def buffer_frame(self, filename):
-        self.frame_buffer[self.frame_idx] = (filename, self.image)
+        self.load_full_quality()
+        self.image_writer.submit(filename, self.image)
 
     def write_buffer(self):
-        for filename, image in self.frame_buffer.values():
-            cv2.imwrite(filename, image)
-        self.frame_buffer = {}
+        self.image_writer.wait()
+
+    def close(self):
+        self.prefetcher.stop()
+        self.keyframe_index.stop()
+        self.thumbnails.stop()
+        if self.proxy is not None:
+            self.proxy.stop()
+        self.frame_cache.clear()
+        self.cap.release()
+
+
+class ImageWriter(QObject):
+    # Encodes and writes images with a thread pool. Images that wait to be
+    # written use at most buffer_mb, submit() blocks until they are flushed.
+    FORMATS = {
+        "jpg": cv2.IMWRITE_JPEG_QUALITY,
+        "png": None,
+        "webp": cv2.IMWRITE_WEBP_QUALITY,
+    }
+
+    STORAGES = ["files", "packed"]
+
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, image_format="jpg", quality=95, n_threads=4,
+                 buffer_mb=256, pack=None):
+        super(ImageWriter, self).__init__()
+        self.image_format = image_format
+        self.pack = pack
+        quality_flag = self.FORMATS[image_format]
+        if quality_flag is None:
+            self.params = []
+        else:
+            self.params = [quality_flag, quality]
+        self.executor = ThreadPoolExecutor(n_threads)
+        self.max_buffer_bytes = buffer_mb * 1024 ** 2
+        self.cond = threading.Condition()
+        self.pending = set()
+        self.n_buffer_bytes = 0
+        self.failed = []
+        self.n_submitted = 0
+        self.n_written = 0
+
+    def exists(self, filename):
+        with self.cond:
+            if filename in self.pending:
+                return True
+        # images written before switching to packed storage are files
+        if self.pack is not None and self.pack.contains(filename):
+            return True
+        return os.path.exists(filename)
+
+    def submit(self, filename, image):
+        with self.cond:
+            # a single image may exceed the limit, otherwise we never write it
+            while (self.n_buffer_bytes > 0 and
+                   self.n_buffer_bytes + image.nbytes > self.max_buffer_bytes):
+                self.cond.wait()
+            self.pending.add(filename)
+            self.n_buffer_bytes += image.nbytes
+            self.n_submitted += 1
+        self.executor.submit(self._write, filename, image)
+
+    def _write(self, filename, image):
+        try:
+            if self.pack is None:
+                success = cv2.imwrite(filename, image, self.params)
+            else:
+                success, data = cv2.imencode(
+                    os.path.splitext(filename)[1], image, self.params)
+                if success:
+                    self.pack.write(filename, data.tobytes())
+        except (cv2.error, OSError):
+            success = False
+        with self.cond:
+            self.pending.discard(filename)
+            if not success:
+                self.failed.append(filename)
+            self.n_buffer_bytes -= image.nbytes
+            self.n_written += 1
+            n_written, n_submitted = self.n_written, self.n_submitted
+            self.cond.notify_all()
+        self.progress.emit(n_written, n_submitted)
+
+    def wait(self):
+        with self.cond:
+            while self.n_written < self.n_submitted:
+                self.cond.wait()
+            failed = self.failed
+            self.failed = []
+        if len(failed) > 0:
+            warnings.warn("Could not write %d images: %s"
+                          % (len(failed), ", ".join(failed)))
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+        if self.pack is not None:
+            self.pack.close()
+
+
+class FrameCache:
+    # Least recently used resized frames, limited by their size in bytes
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.frames = OrderedDict()
+
+    def get(self, frame_idx):
+        image = self.frames.get(frame_idx)
+        if image is not None:
+            self.frames.move_to_end(frame_idx)
+        return image
+
+    def put(self, frame_idx, image):
+        if image.nbytes > self.max_bytes:
+            return
+        if frame_idx in self.frames:
+            self.n_bytes -= self.frames.pop(frame_idx).nbytes
+        self.frames[frame_idx] = image
+        self.n_bytes += image.nbytes
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self.frames.popitem(last=False)
+            self.n_bytes -= evicted.nbytes
+
+    def clear(self):
+        self.frames.clear()
+        self.n_bytes = 0
+
+
+class FramePrefetcher(threading.Thread):
+    # Keeps a ring of up to n_frames consecutive decoded frames starting at
+    # head_idx. Requests outside of this window seek and invalidate the ring.
+    def __init__(self, cap, image_size, n_frames, keyframe_index):
+        super(FramePrefetcher, self).__init__()
+        self.daemon = True
+        self.cap = cap
+        self.image_size = image_size
+        self.n_frames = n_frames
+        self.keyframe_index = keyframe_index
+
+        # cap_lock protects the capture, cond protects everything else
+        self.cap_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.ring = deque()
+        self.head_idx = 0
+        self.decode_idx = 0
+        self.end_idx = None
+        self.generation = 0
+        self.running = True
+
+    def run(self):
+        try:
+            self._decode_frames()
+        finally:
+            with self.cond:
+                self.running = False
+                self.cond.notify_all()
+
+    def _decode_frames(self):
+        while True:
+            with self.cond:
+                while self.running and (len(self.ring) >= self.n_frames or
+                                        self.end_idx is not None):
+                    self.cond.wait()
+                if not self.running:
+                    return
+
+            with self.cap_lock:
+                with self.cond:
+                    generation = self.generation
+                frame_idx = self.decode_idx
+                with PROFILER.span("FramePrefetcher.decode"):
+                    success, image = self.cap.read()
+                self.decode_idx += 1
+
+            if success:
+                with PROFILER.span("FramePrefetcher.resize"):
+                    image = cv2.resize(image, self.image_size)
+
+            with self.cond:
+                if generation != self.generation:
+                    continue
+                if success:
+                    self.ring.append((frame_idx, image))
+                else:
+                    self.end_idx = frame_idx
+                self.cond.notify_all()
+
+    @timed("FramePrefetcher.frame")
+    def frame(self, frame_idx):
+        with self.cond:
+            in_window = self.head_idx <= frame_idx < self.head_idx + self.n_frames
+        if not in_window:
+            self.seek(frame_idx)
+
+        with self.cond:
+            while True:
+                while self.ring and self.ring[0][0] < frame_idx:
+                    self.ring.popleft()
+                    self.head_idx += 1
+                    self.cond.notify_all()
+                if self.ring and self.ring[0][0] == frame_idx:
+                    return self.ring[0][1]
+                if self.end_idx is not None and self.end_idx <= frame_idx:
+                    return None
+                if not self.running:
+                    return None
+                self.cond.wait()
+
+    @timed("FramePrefetcher.seek")
+    def seek(self, frame_idx):
+        keyframe_idx = self.keyframe_index.keyframe_before(frame_idx)
+        with self.cap_lock:
+            if keyframe_idx is None:
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                self.decode_idx = frame_idx
+            else:
+                # decode forward from the closest keyframe, we do not have
+                # to seek if we are already in the same group of pictures
+                if not keyframe_idx <= self.decode_idx <= frame_idx:
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe_idx)
+                    self.decode_idx = keyframe_idx
+                while self.decode_idx < frame_idx and self.cap.grab():
+                    self.decode_idx += 1
+            with self.cond:
+                self.generation += 1
+                self.ring.clear()
+                self.head_idx = frame_idx
+                self.end_idx = None
+                self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.join()
+
+
+class KeyframeIndex:
+    # Frame indices of all keyframes of a video. The index is built once in
+    # the background from the undecoded packets and cached in a file.
+    def __init__(self, filename, cache_filename=None, build=True):
+        self.filename = filename
+        self.cache_filename = cache_filename
+        self.keyframes = None
+        self.running = True
+        self.thread = None
+        if not self._load() and build:
+            self.thread = threading.Thread(target=self._build)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def keyframe_before(self, frame_idx):
+        keyframes = self.keyframes
+        if keyframes is None:
+            return None
+        i = bisect.bisect_right(keyframes, frame_idx)
+        if i == 0:
+            return None
+        return keyframes[i - 1]
+
+    def _load(self):
+        if self.cache_filename is None or not os.path.exists(self.cache_filename):
+            return False
+        with np.load(self.cache_filename) as cache:
+            if int(cache["video_size"]) != os.path.getsize(self.filename):
+                return False
+            self.keyframes = cache["keyframes"].tolist()
+        return True
+
+    def _build(self):
+        has_key_frame = getattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME", None)
+        if has_key_frame is None:
+            return
+        cap = cv2.VideoCapture(self.filename, cv2.CAP_FFMPEG)
+        try:
+            # read packets without decoding them
+            if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+                return
+            keyframes = []
+            frame_idx = 0
+            while self.running:
+                success, _ = cap.read()
+                if not success:
+                    break
+                if cap.get(has_key_frame):
+                    keyframes.append(frame_idx)
+                frame_idx += 1
+            if not self.running or len(keyframes) == 0:
+                return
+        finally:
+            cap.release()
+
+        self.keyframes = keyframes
+        if self.cache_filename is not None:
+            np.savez(
+                self.cache_filename, keyframes=np.array(keyframes),
+                video_size=os.path.getsize(self.filename))
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+
+class ThumbnailCache:
+    # Thumbnails of all frames and their difference hashes. They are computed
+    # in one pass in the background, either in a thread of their own or in
+    # the pass of another consumer of all frames that calls add() and
+    # finish(). Thumbnails are stored in a memory-mapped
+    # file (prefix.npy), hashes and the size of the video in prefix.npz,
+    # which is only written when all frames have been processed. The hash
+    # has 64 bits that compare the brightness of horizontally neighbouring
+    # pixels of a 9x8 version of the thumbnail. The Hamming distance between
+    # the hashes of similar frames is small.
+    def __init__(self, filename, n_frames, size, cache_prefix=None,
+                 build=True):
+        self.filename = filename
+        self.size = size
+        self.cache_prefix = cache_prefix
+        self.n_computed = 0
+        self.complete = False
+        self.running = True
+        self.thread = None
+        if not self._load():
+            shape = (n_frames, size[1], size[0], 3)
+            if cache_prefix is None:
+                self.images = np.zeros(shape, dtype=np.uint8)
+            else:
+                self.images = np.lib.format.open_memmap(
+                    cache_prefix + ".npy", mode="w+", dtype=np.uint8,
+                    shape=shape)
+            self.signatures = np.zeros(n_frames, dtype=np.uint64)
+            if build:
+                self.start()
+
+    def start(self):
+        if self.complete or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self._build)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def thumbnail(self, frame_idx):
+        if not 0 <= frame_idx < self.n_computed:
+            return None
+        return self.images[frame_idx]
+
+    def next_distinct_frame(self, reference_idx, frame_idx, threshold):
+        # first frame after frame_idx that differs from the reference frame
+        n_computed = self.n_computed
+        if reference_idx >= n_computed:
+            return None
+        differences = np.bitwise_xor(
+            self.signatures[frame_idx + 1:n_computed],
+            self.signatures[reference_idx])
+        distances = np.unpackbits(
+            differences.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        distinct = np.flatnonzero(distances > threshold)
+        if len(distinct) == 0:
+            return None
+        return frame_idx + 1 + int(distinct[0])
+
+    def _load(self):
+        if (self.cache_prefix is None or
+                not os.path.exists(self.cache_prefix + ".npz") or
+                not os.path.exists(self.cache_prefix + ".npy")):
+            return False
+        with np.load(self.cache_prefix + ".npz") as cache:
+            if int(cache["video_size"]) != os.path.getsize(self.filename):
+                return False
+            signatures = cache["signatures"]
+        images = np.load(self.cache_prefix + ".npy", mmap_mode="r")
+        if images.shape[1:3] != (self.size[1], self.size[0]):
+            return False
+        self.images = images
+        self.signatures = signatures
+        self.n_computed = len(self.signatures)
+        self.complete = True
+        return True
+
+    def _build(self):
+        cap = cv2.VideoCapture(self.filename)
+        try:
+            while self.running and self.n_computed < len(self.signatures):
+                success, image = cap.read()
+                if not success:
+                    break
+                self.add(image)
+            if not self.running:
+                return
+        finally:
+            cap.release()
+        self.finish()
+
+    def add(self, image):
+        # next frame of the video
+        if self.complete or self.n_computed >= len(self.signatures):
+            return
+        thumbnail = cv2.resize(image, self.size, interpolation=cv2.INTER_AREA)
+        self.images[self.n_computed] = thumbnail
+        self.signatures[self.n_computed] = difference_hash(thumbnail)
+        self.n_computed += 1
+
+    def finish(self):
+        if self.complete:
+            return
+        self.signatures = self.signatures[:self.n_computed]
+        self.complete = True
+        if self.cache_prefix is not None:
+            self.images.flush()
+            np.savez(
+                self.cache_prefix + ".npz", signatures=self.signatures,
+                video_size=os.path.getsize(self.filename))
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+
+class ProxyVideo:
+    # Low resolution copy of a video with Motion JPEG compression. Every
+    # frame is a keyframe, so frames can be read in any order without
+    # decoding other frames. The proxy is transcoded once in the background
+    # to prefix.avi. prefix.npz contains the size of the original video.
+    # Decoded frames are passed on to the thumbnails, if they are given, so
+    # that the video is only decoded once.
+    def __init__(self, filename, size, cache_prefix, thumbnails=None):
+        self.filename = filename
+        self.size = size
+        self.cache_prefix = cache_prefix
+        self.thumbnails = thumbnails
+        self.cap = None
+        self.position = -1
+        self.running = True
+        self.thread = None
+        if not self._load():
+            self.thread = threading.Thread(target=self._build)
+            self.thread.daemon = True
+            self.thread.start()
+
+    @timed("ProxyVideo.frame")
+    def frame(self, frame_idx):
+        # None while the proxy is transcoded
+        cap = self.cap
+        if cap is None:
+            return None
+        if frame_idx != self.position:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        success, image = cap.read()
+        if not success:
+            self.position = -1
+            return None
+        self.position = frame_idx + 1
+        return image
+
+    def _load(self):
+        if (not os.path.exists(self.cache_prefix + ".npz") or
+                not os.path.exists(self.cache_prefix + ".avi")):
+            return False
+        with np.load(self.cache_prefix + ".npz") as cache:
+            if (int(cache["video_size"]) != os.path.getsize(self.filename) or
+                    tuple(cache["size"]) != tuple(self.size)):
+                return False
+        self.cap = cv2.VideoCapture(self.cache_prefix + ".avi")
+        return self.cap.isOpened()
+
+    def _build(self):
+        tmp_filename = self.cache_prefix + ".tmp.avi"
+        cap = cv2.VideoCapture(self.filename)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        writer = cv2.VideoWriter(
+            tmp_filename, cv2.VideoWriter_fourcc(*"MJPG"),
+            fps if fps > 0 else 30.0, self.size)
+        try:
+            while self.running:
+                success, image = cap.read()
+                if not success:
+                    break
+                writer.write(
+                    cv2.resize(image, self.size, interpolation=cv2.INTER_AREA))
+                if self.thumbnails is not None:
+                    self.thumbnails.add(image)
+        finally:
+            writer.release()
+            cap.release()
+        if not self.running:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return
+        if self.thumbnails is not None:
+            self.thumbnails.finish()
+
+        os.replace(tmp_filename, self.cache_prefix + ".avi")
+        np.savez(self.cache_prefix + ".npz",
+                 video_size=os.path.getsize(self.filename), size=self.size)
+        self.cap = cv2.VideoCapture(self.cache_prefix + ".avi")
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        if self.cap is not None:
+            self.cap.release()
+
+
+def difference_hash(image):
+    thumbnail = cv2.cvtColor(
+        cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA),
+        cv2.COLOR_BGR2GRAY)
+    return np.packbits(thumbnail[:, 1:] > thumbnail[:, :-1]).view(np.uint64)[0]
+
+
+def read_frames(filename, frame_indices, image_size, keyframe_index=None):
+    # Decodes the given frames in one sequential pass. We only seek to the
+    # first frame, backwards or to a keyframe that is closer to the next
+    # frame than the current position, all other frames are skipped with
+    # grab().
+    cap = cv2.VideoCapture(filename)
+    try:
+        position = 0
+        for frame_idx in sorted(frame_indices):
+            keyframe_idx = None
+            if keyframe_index is not None:
+                keyframe_idx = keyframe_index.keyframe_before(frame_idx)
+            if keyframe_idx is None:
+                if frame_idx < position or position == 0 < frame_idx:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                    position = frame_idx
+            elif frame_idx < position or keyframe_idx > position:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe_idx)
+                position = keyframe_idx
+            while position < frame_idx and cap.grab():
+                position += 1
+            success, image = cap.read()
+            if not success:
+                return
+            position += 1
+            yield frame_idx, cv2.resize(image, image_size)
+    finally:
+        cap.release()
+
+
+def extract(annotations_filename, output_path, videos, annotator_config,
+            source_size=None, n_processes=1):
+    store = AnnotationStore()
+    store.load(annotations_filename)
+    if source_size is None:
+        source_size = annotator_config.image_size
+    scale = np.array(
+        [annotator_config.image_size[0] / float(source_size[0]),
+         annotator_config.image_size[1] / float(source_size[1])] * 2)
+
+    video_filenames = {video_identifier(video): video for video in videos}
+    frames_per_video = {identifier: [] for identifier in video_filenames}
+    n_skipped = 0
+    for image_filename, frame_idx in store.frames.keys():
+        match = IMAGE_FILENAME_PATTERN.search(image_filename)
+        if match is None or match.group(1) not in video_filenames:
+            n_skipped += 1
+            continue
+        frames_per_video[match.group(1)].append((frame_idx, image_filename))
+    if n_skipped > 0:
+        warnings.warn("Skipped %d frames that do not belong to any of the "
+                      "given videos." % n_skipped)
+
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    # Each shard is a range of frames of one video that is decoded
+    # sequentially. There are a few more shards than processes so that
+    # videos of different length are balanced. Keyframes are indexed before
+    # so that each shard can seek to its first frame.
+    keyframes_filenames = {}
+    for identifier, frames in frames_per_video.items():
+        if len(frames) == 0:
+            continue
+        keyframes_filenames[identifier] = os.path.join(
+            os.path.dirname(annotations_filename),
+            "keyframes_%s.npz" % identifier)
+        keyframe_index = KeyframeIndex(
+            video_filenames[identifier], keyframes_filenames[identifier])
+        if keyframe_index.thread is not None:
+            keyframe_index.thread.join()
+    n_frames = sum(len(frames) for frames in frames_per_video.values())
+    shard_size = max(int(np.ceil(n_frames / (4.0 * n_processes))), 1)
+    shards = []
+    pack_prefixes = []
+    for identifier, frames in frames_per_video.items():
+        frames = sorted(frames)
+        for start in range(0, len(frames), shard_size):
+            # images of each shard are packed in separate tar files whose
+            # indices are merged afterwards
+            pack_prefix = None
+            if annotator_config.image_storage == "packed":
+                pack_prefix = "images_shard%05d" % len(shards)
+                pack_prefixes.append(pack_prefix)
+            shard_frames = []
+            for frame_idx, image_filename in frames[start:start + shard_size]:
+                boxes = store.get(image_filename, frame_idx).copy()
+                boxes[:, :4] = np.round(boxes[:, :4] * scale)
+                shard_frames.append((frame_idx, image_filename, boxes))
+            shards.append((
+                os.path.join(output_path, "annotations.shard%05d.npz" % len(shards)),
+                video_filenames[identifier], keyframes_filenames[identifier],
+                shard_frames, output_path, annotator_config.image_size,
+                annotator_config.image_format, annotator_config.image_quality,
+                annotator_config.n_writer_threads,
+                annotator_config.frame_buffer_mb, pack_prefix,
+                annotator_config.pack_shard_mb))
+
+    if n_processes > 1:
+        with multiprocessing.Pool(n_processes, initializer=cv2.setNumThreads,
+                                  initargs=(1,)) as pool:
+            shard_filenames = pool.map(_extract_shard, shards, chunksize=1)
+    else:
+        shard_filenames = [_extract_shard(shard) for shard in shards]
+
+    if annotator_config.image_storage == "packed":
+        pack = ImagePack(output_path)
+        for pack_prefix in pack_prefixes:
+            pack.merge(pack_prefix)
+        pack.close()
+    # the annotations of all shards are merged in the order of the shards
+    output_store = AnnotationStore()
+    for shard_filename in shard_filenames:
+        shard_store = AnnotationStore()
+        shard_store.load(shard_filename)
+        for (image_filename, frame_idx), boxes in shard_store.frames.items():
+            output_store.replace(image_filename, frame_idx, boxes)
+        os.remove(shard_filename)
+    output_store.save(os.path.join(
+        output_path, "annotations." + annotator_config.annotation_format))
+    print("Extracted %d images to %s" % (len(output_store.frames), output_path))
+
+
+def _extract_shard(shard):
+    # runs in a worker process with its own video capture
+    (shard_filename, video, keyframes_filename, frames, output_path,
+     image_size, image_format, image_quality, n_writer_threads,
+     frame_buffer_mb, pack_prefix, pack_shard_mb) = shard
+    keyframe_index = KeyframeIndex(video, keyframes_filename, build=False)
+    pack = None
+    if pack_prefix is not None:
+        pack = ImagePack(output_path, pack_prefix, pack_shard_mb)
+    image_writer = ImageWriter(
+        image_format, image_quality, n_writer_threads, frame_buffer_mb, pack)
+    frames = {frame_idx: (image_filename, boxes)
+              for frame_idx, image_filename, boxes in frames}
+    shard_store = AnnotationStore()
+    for frame_idx, image in read_frames(
+            video, frames.keys(), image_size, keyframe_index):
+        image_filename, boxes = frames[frame_idx]
+        output_filename = os.path.join(
+            output_path, "%s.%s" % (
+                os.path.splitext(os.path.basename(image_filename))[0],
+                image_format))
+        image_writer.submit(output_filename, image)
+        shard_store.replace(output_filename, frame_idx, boxes)
+    image_writer.close()
+    shard_store.save(shard_filename)
+    return shard_filename
+
+
+EXPORT_FORMATS = ["coco", "yolo", "webdataset", "tfrecord"]
+
+
+def export(annotations_filename, output_path, annotator_config, export_format,
+           root_dir=".", shard_size=1000):
+    # Writes annotations in formats of common training frameworks. The
+    # annotations file is read one frame after another and only the current
+    # frame and its image are held in memory. All images have the configured
+    # resolution.
+    if export_format not in EXPORT_FORMATS:
+        raise Exception("Unknown export format '%s', available formats: %s"
+                        % (export_format, ", ".join(EXPORT_FORMATS)))
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    frames = AnnotationStore.stream(annotations_filename)
+    if export_format == "coco":
+        n_images = _export_coco(frames, output_path, annotator_config)
+    elif export_format == "yolo":
+        n_images = _export_yolo(frames, output_path, annotator_config)
+    elif export_format == "webdataset":
+        n_images = _export_webdataset(
+            frames, output_path, annotator_config, root_dir, shard_size)
+    else:
+        n_images = _export_tfrecord(
+            frames, output_path, annotator_config, root_dir, shard_size)
+    print("Exported %d images to %s" % (n_images, output_path))
+
+
+def _reviewed_frames(frames):
+    # suggestions that have not been reviewed are not exported
+    for image_filename, frame_idx, boxes in frames:
+        boxes = boxes[boxes[:, 6] != 0]
+        if len(boxes) > 0:
+            yield image_filename, frame_idx, boxes
+
+
+def _export_coco(frames, output_path, annotator_config):
+    # images and annotations are written as a stream of JSON objects, the
+    # annotations go to a temporary file until all images are written
+    width, height = annotator_config.image_size
+    n_images = 0
+    with open(os.path.join(output_path, "annotations_coco.json"), "w") as f, \
+            tempfile.TemporaryFile("w+") as annotations_file:
+        f.write('{"categories": %s,\n"images": [' % json.dumps(
+            [{"id": class_idx + 1, "name": name}
+             for class_idx, name in enumerate(annotator_config.classes)]))
+        annotation_id = 0
+        for image_id, (image_filename, frame_idx, boxes) in enumerate(
+                _reviewed_frames(frames)):
+            if image_id > 0:
+                f.write(",")
+            f.write("\n" + json.dumps(
+                {"id": image_id, "file_name": image_filename, "width": width,
+                 "height": height, "frame_idx": frame_idx}))
+            for x_min, y_min, x_max, y_max, class_idx, track_id, _ in boxes.tolist():
+                if annotation_id > 0:
+                    annotations_file.write(",")
+                annotations_file.write("\n" + json.dumps(
+                    {"id": annotation_id, "image_id": image_id,
+                     "category_id": class_idx + 1,
+                     "bbox": [x_min, y_min, x_max - x_min, y_max - y_min],
+                     "area": (x_max - x_min) * (y_max - y_min), "iscrowd": 0,
+                     "track_id": track_id}))
+                annotation_id += 1
+            n_images += 1
+        f.write('],\n"annotations": [')
+        annotations_file.seek(0)
+        shutil.copyfileobj(annotations_file, f)
+        f.write("]}\n")
+    return n_images
+
+
+def _export_yolo(frames, output_path, annotator_config):
+    # one text file per image with class, center and size relative to the
+    # image size
+    labels_path = os.path.join(output_path, "labels")
+    if not os.path.exists(labels_path):
+        os.makedirs(labels_path)
+    with open(os.path.join(output_path, "classes.txt"), "w") as f:
+        f.write("".join(name + "\n" for name in annotator_config.classes))
+    size = np.array(annotator_config.image_size * 2, dtype=float)
+    n_images = 0
+    with open(os.path.join(output_path, "images.txt"), "w") as images_file:
+        for image_filename, _, boxes in _reviewed_frames(frames):
+            images_file.write(image_filename + "\n")
+            relative = boxes[:, :4] / size
+            centers = (relative[:, :2] + relative[:, 2:]) / 2.0
+            sizes = relative[:, 2:] - relative[:, :2]
+            label_filename = os.path.join(labels_path, os.path.splitext(
+                os.path.basename(image_filename))[0] + ".txt")
+            with open(label_filename, "w") as f:
+                for class_idx, center, box_size in zip(
+                        boxes[:, 4].tolist(), centers, sizes):
+                    f.write("%d %.6f %.6f %.6f %.6f\n" % (
+                        class_idx, center[0], center[1], box_size[0],
+                        box_size[1]))
+            n_images += 1
+    return n_images
+
+
+def _export_samples(frames, annotator_config, root_dir):
+    # encoded image and annotations of one frame after another
+    width, height = annotator_config.image_size
+    for image_filename, frame_idx, boxes in _reviewed_frames(frames):
+        data = read_encoded_image(os.path.join(root_dir, image_filename))
+        yield image_filename, data, {
+            "file_name": image_filename, "frame_idx": frame_idx,
+            "width": width, "height": height,
+            "boxes": boxes[:, :4].tolist(), "classes": boxes[:, 4].tolist(),
+            "track_ids": boxes[:, 5].tolist()}
+
+
+def _export_webdataset(frames, output_path, annotator_config, root_dir,
+                       shard_size):
+    # tar files with shard_size samples, each sample consists of the image
+    # and a JSON file with the same name
+    shard = None
+    n_images = 0
+    for sample_idx, (image_filename, data, annotation) in enumerate(
+            _export_samples(frames, annotator_config, root_dir)):
+        if sample_idx % shard_size == 0:
+            if shard is not None:
+                shard.close()
+            shard = tarfile.open(os.path.join(
+                output_path, "shard-%06d.tar" % (sample_idx // shard_size)), "w")
+        key, extension = os.path.splitext(os.path.basename(image_filename))
+        _add_to_tar(shard, key + extension, data)
+        _add_to_tar(shard, key + ".json", json.dumps(annotation).encode())
+        n_images += 1
+    if shard is not None:
+        shard.close()
+    return n_images
+
+
+def _add_to_tar(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _export_tfrecord(frames, output_path, annotator_config, root_dir,
+                     shard_size):
+    # features of the TensorFlow Object Detection API
+    try:
+        import tensorflow as tf
+    except ImportError:
+        raise Exception("Export to TFRecord requires tensorflow")
+
+    def floats(values):
+        return tf.train.Feature(float_list=tf.train.FloatList(value=values))
+
+    def ints(values):
+        return tf.train.Feature(int64_list=tf.train.Int64List(value=values))
+
+    def strings(values):
+        return tf.train.Feature(bytes_list=tf.train.BytesList(value=values))
+
+    classes = [name.encode() for name in annotator_config.classes]
+    writer = None
+    n_images = 0
+    for sample_idx, (image_filename, data, annotation) in enumerate(
+            _export_samples(frames, annotator_config, root_dir)):
+        if sample_idx % shard_size == 0:
+            if writer is not None:
+                writer.close()
+            writer = tf.io.TFRecordWriter(os.path.join(
+                output_path, "shard-%06d.tfrecord" % (sample_idx // shard_size)))
+        boxes = np.array(annotation["boxes"], dtype=float).reshape(-1, 4)
+        width, height = annotation["width"], annotation["height"]
+
+        example = tf.train.Example(features=tf.train.Features(feature={
+            "image/encoded": strings([data]),
+            "image/format": strings(
+                [os.path.splitext(image_filename)[1][1:].encode()]),
+            "image/filename": strings([image_filename.encode()]),
+            "image/width": ints([width]),
+            "image/height": ints([height]),
+            "image/object/bbox/xmin": floats((boxes[:, 0] / width).tolist()),
+            "image/object/bbox/ymin": floats((boxes[:, 1] / height).tolist()),
+            "image/object/bbox/xmax": floats((boxes[:, 2] / width).tolist()),
+            "image/object/bbox/ymax": floats((boxes[:, 3] / height).tolist()),
+            "image/object/class/label": ints(
+                [class_idx + 1 for class_idx in annotation["classes"]]),
+            "image/object/class/text": strings(
+                [classes[class_idx] for class_idx in annotation["classes"]]),
+        }))
+        writer.write(example.SerializeToString())
+        n_images += 1
+    if writer is not None:
+        writer.close()
+    return n_images
+
+
+def expand_video_filenames(patterns):
+    filenames = []
+    for pattern in patterns:
+        if any(c in pattern for c in "*?["):
+            filenames.extend(sorted(glob.glob(pattern)))
+        else:
+            filenames.append(pattern)
+    if len(filenames) == 0:
+        raise Exception("Could not find any video")
+    return filenames
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Annotator")
-    parser.add_argument("video", help="Location of the video file")
+    parser.add_argument(
+        "video", nargs="+",
+        help="Location of the video files, may contain wildcards")
     parser.add_argument("output", help="Output directory")
     parser.add_argument(
         "--config", nargs="?", default=None,
         help="Configuration file for annotator")
+    parser.add_argument(
+        "--profile", default=None,
+        help="Show timings of frequent operations and store them in a "
+        "Chrome trace file when the annotator is closed")
     return parser.parse_args()
 
 
+def parse_extract_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="main.py extract",
+        description="Extract annotated frames without the user interface")
+    parser.add_argument(
+        "annotations", help="Existing annotations.csv or annotations.npz")
+    parser.add_argument("output", help="Output directory")
+    parser.add_argument(
+        "videos", nargs="+",
+        help="Annotated video files, may contain wildcards")
+    parser.add_argument(
+        "--config", nargs="?", default=None,
+        help="Configuration file for annotator, defines the new resolution")
+    parser.add_argument(
+        "--source_resolution", nargs=2, type=int, default=None,
+        help="Resolution of the existing annotations if it differs from "
+        "the configured resolution")
+    parser.add_argument(
+        "--processes", type=int, default=1,
+        help="Number of processes that decode videos and write images")
+    return parser.parse_args(argv)
+
+
+def parse_export_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="main.py export",
+        description="Export annotations for training frameworks")
+    parser.add_argument(
+        "annotations", help="Existing annotations.csv or annotations.npz")
+    parser.add_argument("output", help="Output directory")
+    parser.add_argument(
+        "--format", choices=EXPORT_FORMATS, default="coco",
+        help="Export format")
+    parser.add_argument(
+        "--config", nargs="?", default=None,
+        help="Configuration file for annotator, defines classes and "
+        "resolution of the images")
+    parser.add_argument(
+        "--root", default=".",
+        help="Directory to which image names are relative")
+    parser.add_argument(
+        "--shard_size", type=int, default=1000,
+        help="Images per file of webdataset and tfrecord")
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "extract":
+        args = parse_extract_args(sys.argv[2:])
+        extract(args.annotations, args.output,
+                expand_video_filenames(args.videos),
+                AnnotatorConfigurationModel(args.config),
+                args.source_resolution, args.processes)
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        args = parse_export_args(sys.argv[2:])
+        export(args.annotations, args.output,
+               AnnotatorConfigurationModel(args.config), args.format,
+               args.root, args.shard_size)
+        sys.exit(0)
     app = QApplication(sys.argv)
     args = parse_args()
+    PROFILER.enabled = args.profile is not None
     win = MainWindow(args)
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,73 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+import numpy as np
+import cv2
+import pytest
+from PyQt5.QtWidgets import QApplication
+from main import AnnotationStore
+
+
+N_FRAMES = 60
+VIDEO_SIZE = (160, 120)
+
+
+@pytest.fixture(scope="session")
+def video_filename(tmp_path_factory):
+    # moving rectangles, every frame looks different
+    filename = str(tmp_path_factory.mktemp("video") / "video.avi")
+    params = []
+    key_interval = getattr(cv2, "VIDEOWRITER_PROP_KEY_INTERVAL", None)
+    if key_interval is not None:
+        params = [key_interval, 12]
+    writer = cv2.VideoWriter(
+        filename, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*"XVID"), 30.0,
+        VIDEO_SIZE, params)
+    if not writer.isOpened():
+        pytest.skip("Cannot write videos")
+    for i in range(N_FRAMES):
+        image = np.full((VIDEO_SIZE[1], VIDEO_SIZE[0], 3), 40, dtype=np.uint8)
+        cv2.rectangle(image, (2 * i, 10), (2 * i + 30, 40), (0, 255, 0), -1)
+        cv2.rectangle(image, (10, i), (40, i + 30), (255, 0, 0), -1)
+        writer.write(image)
+    writer.release()
+    return filename
+
+
+@pytest.fixture(scope="session")
+def video_frames(video_filename):
+    cap = cv2.VideoCapture(video_filename)
+    frames = []
+    while True:
+        success, image = cap.read()
+        if not success:
+            break
+        frames.append(image)
+    cap.release()
+    return frames
+
+
+@pytest.fixture(scope="session")
+def qapp():
+    # signals of worker threads are delivered by processing events, widgets
+    # are drawn offscreen
+    return QApplication.instance() or QApplication([])
+
+
+def _boxes(n_boxes, class_idx=0, first_track_id=0, reviewed=1, x=0):
+    # boxes next to each other, starting at x, with consecutive track IDs
+    boxes = np.empty((n_boxes, AnnotationStore.N_COLUMNS), dtype=np.int32)
+    boxes[:, 0] = x + np.arange(n_boxes) * 10
+    boxes[:, 1] = 5
+    boxes[:, 2] = boxes[:, 0] + 8
+    boxes[:, 3] = 20
+    boxes[:, 4] = class_idx
+    boxes[:, 5] = np.arange(first_track_id, first_track_id + n_boxes)
+    boxes[:, 6] = reviewed
+    return boxes
+
+
+@pytest.fixture
+def make_boxes():
+    return _boxes
@@ -0,0 +1,178 @@
+import os
+import tarfile
+import numpy as np
+import cv2
+import pytest
+import annotated_images
+from annotated_images import (
+    ImagePack, read_encoded_image, read_image, read_image_size)
+
+
+def _name(path, frame_idx):
+    return os.path.join(str(path), "annotated_%s_%08d.jpg" % ("0" * 32, frame_idx))
+
+
+def _data(frame_idx, size=1000):
+    return bytes([frame_idx % 256]) * size
+
+
+def test_pack_write_and_read(tmp_path):
+    pack = ImagePack(str(tmp_path))
+    for frame_idx in range(5):
+        pack.write(_name(tmp_path, frame_idx), _data(frame_idx))
+    assert pack.contains(_name(tmp_path, 3))
+    assert not pack.contains(_name(tmp_path, 5))
+    assert pack.read(_name(tmp_path, 2)) == _data(2)
+    assert pack.read(_name(tmp_path, 5)) is None
+
+    # the tar file is mapped again when it has grown
+    old_map = pack.maps["images-00000.tar"]
+    pack.write(_name(tmp_path, 5), _data(5))
+    assert pack.read(_name(tmp_path, 5)) == _data(5)
+    assert old_map.closed
+    pack.close()
+
+    # the tar file can be read by other tools
+    with tarfile.open(str(tmp_path / "images-00000.tar")) as tar:
+        assert tar.getnames() == [
+            os.path.basename(_name(tmp_path, i)) for i in range(6)]
+        member = tar.extractfile(os.path.basename(_name(tmp_path, 4)))
+        assert member.read() == _data(4)
+
+
+def test_pack_reopen_appends_to_last_tar_file(tmp_path):
+    pack = ImagePack(str(tmp_path))
+    pack.write(_name(tmp_path, 0), _data(0))
+    pack.close()
+    pack = ImagePack(str(tmp_path))
+    assert pack.contains(_name(tmp_path, 0))
+    pack.write(_name(tmp_path, 1), _data(1))
+    # images are replaced by writing them again
+    pack.write(_name(tmp_path, 0), _data(7))
+    pack.close()
+
+    assert sorted(os.listdir(str(tmp_path))) == ["images-00000.tar",
+                                                 "images.index"]
+    pack = ImagePack(str(tmp_path))
+    assert pack.read(_name(tmp_path, 0)) == _data(7)
+    assert pack.read(_name(tmp_path, 1)) == _data(1)
+    pack.close()
+    with tarfile.open(str(tmp_path / "images-00000.tar")) as tar:
+        assert len(tar.getnames()) == 3
+
+
+def test_pack_recovers_from_partial_write(tmp_path):
+    pack = ImagePack(str(tmp_path))
+    pack.write(_name(tmp_path, 0), _data(0))
+    pack.write(_name(tmp_path, 1), _data(1))
+    pack.close()
+    # interrupted while writing the data and the index line of an image
+    with open(str(tmp_path / "images-00000.tar"), "ab") as f:
+        f.write(b"\1" * 700)
+    with open(str(tmp_path / "images.index"), "a") as f:
+        f.write(os.path.basename(_name(tmp_path, 2)) + ",images-000")
+
+    pack = ImagePack(str(tmp_path))
+    assert not pack.contains(_name(tmp_path, 2))
+    pack.write(_name(tmp_path, 3), _data(3))
+    pack.close()
+
+    with open(str(tmp_path / "images.index")) as f:
+        lines = f.read().splitlines()
+    assert [line.split(",")[0] for line in lines] == [
+        os.path.basename(_name(tmp_path, i)) for i in [0, 1, 3]]
+    pack = ImagePack(str(tmp_path))
+    for frame_idx in [0, 1, 3]:
+        assert pack.read(_name(tmp_path, frame_idx)) == _data(frame_idx)
+    pack.close()
+    with tarfile.open(str(tmp_path / "images-00000.tar")) as tar:
+        assert len(tar.getnames()) == 3
+
+
+def test_pack_starts_new_tar_file(tmp_path):
+    pack = ImagePack(str(tmp_path), shard_mb=1)
+    for frame_idx in range(6):
+        pack.write(_name(tmp_path, frame_idx), _data(frame_idx, 300000))
+    pack.close()
+    assert sorted(os.listdir(str(tmp_path))) == [
+        "images-00000.tar", "images-00001.tar", "images.index"]
+    pack = ImagePack(str(tmp_path), shard_mb=1)
+    for frame_idx in range(6):
+        assert pack.read(_name(tmp_path, frame_idx)) == _data(frame_idx, 300000)
+    pack.close()
+
+
+def test_pack_merge(tmp_path):
+    shard_pack = ImagePack(str(tmp_path), "images_shard00000")
+    shard_pack.write(_name(tmp_path, 0), _data(0))
+    shard_pack.close()
+    pack = ImagePack(str(tmp_path))
+    pack.merge("images_shard00000")
+    assert pack.read(_name(tmp_path, 0)) == _data(0)
+    pack.close()
+    assert not (tmp_path / "images_shard00000.index").exists()
+
+
+def test_read_encoded_image_of_other_process(tmp_path):
+    with open(str(tmp_path / "annotated_file.jpg"), "wb") as f:
+        f.write(b"file")
+    assert read_encoded_image(str(tmp_path / "annotated_file.jpg")) == b"file"
+    pack = ImagePack(str(tmp_path))
+    pack.write(_name(tmp_path, 0), _data(0))
+    assert read_encoded_image(_name(tmp_path, 0)) == _data(0)
+    # the index is read again when an image is missing
+    pack.write(_name(tmp_path, 1), _data(1))
+    assert read_encoded_image(_name(tmp_path, 1)) == _data(1)
+    pack.close()
+    with pytest.raises(Exception):
+        read_encoded_image(_name(tmp_path, 2))
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError("image has been decoded")
+
+
+@pytest.mark.parametrize("extension", [".jpg", ".png", ".webp"])
+def test_read_image_size(tmp_path, monkeypatch, extension):
+    # sizes are read from the headers without decoding the image
+    monkeypatch.setattr(annotated_images, "read_image", _fail)
+    image = np.zeros((37, 53, 3), dtype=np.uint8)
+    image[5:20, 10:30] = 255
+    success, data = cv2.imencode(extension, image)
+    assert success
+    filename = str(tmp_path / ("image" + extension))
+    with open(filename, "wb") as f:
+        f.write(data.tobytes())
+    assert read_image_size(filename) == (37, 53)
+
+    pack = ImagePack(str(tmp_path / "packed"))
+    packed_filename = _name(tmp_path / "packed", 0)
+    pack.write(packed_filename, data.tobytes())
+    pack.close()
+    assert read_image_size(packed_filename) == (37, 53)
+    monkeypatch.undo()
+    assert read_image(packed_filename).shape == (37, 53, 3)
+
+
+def test_read_image_size_of_lossless_webp(tmp_path, monkeypatch):
+    monkeypatch.setattr(annotated_images, "read_image", _fail)
+    image = np.zeros((21, 17, 3), dtype=np.uint8)
+    success, data = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    assert success
+    filename = str(tmp_path / "image.webp")
+    with open(filename, "wb") as f:
+        f.write(data.tobytes())
+    assert read_image_size(filename) == (21, 17)
+
+
+@pytest.mark.parametrize("truncated_at", [4, 6, 21, 23])
+def test_read_image_size_of_truncated_jpeg(tmp_path, monkeypatch,
+                                           truncated_at):
+    # incomplete headers are decoded instead
+    monkeypatch.setattr(annotated_images, "read_image",
+                        lambda filename: np.zeros((3, 4, 3), dtype=np.uint8))
+    data = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x00" * 9 + b"\xff\xff\xff"
+    filename = str(tmp_path / "image.jpg")
+    with open(filename, "wb") as f:
+        f.write(data[:truncated_at])
+    assert read_image_size(filename) == (3, 4)
@@ -0,0 +1,68 @@
+import numpy as np
+from main import AnnotationJournal, AnnotationStore
+
+
+def test_replay(tmp_path, make_boxes):
+    prefix = str(tmp_path / "annotations.journal")
+    journal = AnnotationJournal(prefix)
+    journal.append("a.jpg", 0, make_boxes(1, x=1))
+    journal.extend([("b.jpg", 1, make_boxes(1, x=2)),
+                    ("a.jpg", 0, make_boxes(1, x=3))])
+    journal.append("c.jpg", 2, np.empty((0, AnnotationStore.N_COLUMNS)))
+    journal.close()
+
+    store = AnnotationStore()
+    store.replace("c.jpg", 2, make_boxes(1, x=4))
+    recovered = AnnotationJournal(prefix).replay(store)
+    assert recovered == [("a.jpg", 0), ("b.jpg", 1), ("c.jpg", 2)]
+    # the last change of a frame wins, deleted boxes stay deleted
+    assert np.array_equal(store.get("a.jpg", 0), make_boxes(1, x=3))
+    assert np.array_equal(store.get("b.jpg", 1), make_boxes(1, x=2))
+    assert len(store.get("c.jpg", 2)) == 0
+
+
+def test_replay_ignores_truncated_last_line(tmp_path, make_boxes):
+    prefix = str(tmp_path / "annotations.journal")
+    journal = AnnotationJournal(prefix)
+    journal.append("a.jpg", 0, make_boxes(1, x=1))
+    journal.append("b.jpg", 1, make_boxes(1, x=2))
+    journal.close()
+    segment = journal.segments()[-1]
+    with open(segment, "r") as f:
+        content = f.read()
+    with open(segment, "w") as f:
+        f.write(content[:-5])
+
+    store = AnnotationStore()
+    recovered = AnnotationJournal(prefix).replay(store)
+    assert recovered == [("a.jpg", 0)]
+    assert np.array_equal(store.get("a.jpg", 0), make_boxes(1, x=1))
+    assert len(store.get("b.jpg", 1)) == 0
+
+
+def test_replay_after_rotation(tmp_path, make_boxes):
+    prefix = str(tmp_path / "annotations.journal")
+    journal = AnnotationJournal(prefix)
+    journal.append("a.jpg", 0, make_boxes(1, x=1))
+    old_segments = journal.rotate()
+    journal.append("a.jpg", 0, make_boxes(1, x=2))
+    journal.append("b.jpg", 1, make_boxes(1, x=3))
+    journal.close()
+    assert len(old_segments) == 1
+    assert len(journal.segments()) == 2
+
+    # later segments take precedence
+    store = AnnotationStore()
+    AnnotationJournal(prefix).replay(store)
+    assert np.array_equal(store.get("a.jpg", 0), make_boxes(1, x=2))
+
+    # a new journal continues after the last segment
+    journal = AnnotationJournal(prefix)
+    journal.remove(old_segments)
+    journal.append("b.jpg", 1, make_boxes(1, x=4))
+    journal.close()
+    assert len(journal.segments()) == 2
+    store = AnnotationStore()
+    AnnotationJournal(prefix).replay(store)
+    assert np.array_equal(store.get("a.jpg", 0), make_boxes(1, x=2))
+    assert np.array_equal(store.get("b.jpg", 1), make_boxes(1, x=4))
@@ -0,0 +1,147 @@
+import warnings
+import numpy as np
+import pytest
+from main import AnnotationModel, AnnotatorConfigurationModel, BoxPropagator
+from conftest import VIDEO_SIZE
+
+
+def _config(tmp_path, tracker="optical_flow"):
+    filename = str(tmp_path / "config.yaml")
+    with open(filename, "w") as f:
+        f.write("classes: [a, b]\nresolution: [%d, %d]\ntracker: %s\n"
+                % (VIDEO_SIZE + (tracker,)))
+    return AnnotatorConfigurationModel(filename)
+
+
+@pytest.fixture
+def model(tmp_path, video_filename, qapp):
+    model = AnnotationModel(
+        [video_filename], str(tmp_path / "out"), _config(tmp_path))
+    yield model
+    model.close()
+
+
+def test_propagate_boxes(video_filename, video_frames, qapp):
+    # the green rectangle moves right and the blue one down
+    propagator = BoxPropagator(VIDEO_SIZE, "optical_flow")
+    propagated = []
+    propagator.propagated.connect(
+        lambda video, frame_idx, boxes: propagated.append((frame_idx, boxes)))
+    boxes = np.array([[60, 10, 90, 40, 1, 7, 1], [10, 30, 40, 60, 0, 8, 1]],
+                     dtype=np.int32)
+    propagator.start(video_filename, 30, video_frames[30], boxes, 5)
+    propagator.thread.join()
+    qapp.processEvents()
+
+    assert [frame_idx for frame_idx, _ in propagated] == [31, 32, 33, 34, 35]
+    for frame_idx, tracked in propagated:
+        offset = frame_idx - 30
+        expected = [[60 + 2 * offset, 10, 90 + 2 * offset, 40],
+                    [10, 30 + offset, 40, 60 + offset]]
+        assert np.abs(tracked[:, :4] - expected).max() <= 1
+        # class and track ID are kept, tracked boxes are suggestions
+        assert tracked[:, 4:6].tolist() == [[1, 7], [0, 8]]
+        assert np.all(tracked[:, 6] == 0)
+
+
+def test_apply_propagated_keeps_annotated_frames(model):
+    video_filename = model.video_filenames[0]
+    model.add_box([10, 10], [20, 20], 0)
+    model.skip(2)
+    model.add_box([30, 10], [40, 20], 1)
+    model.skip(-2)
+    annotated = model.store.get(model._image_filename(2), 2).copy()
+
+    tracked = np.array([[12, 10, 22, 20, 0, 0, 0]], dtype=np.int32)
+    assert not model.apply_propagated(video_filename, 2, tracked)
+    assert np.array_equal(model.store.get(model._image_filename(2), 2),
+                          annotated)
+    assert not model.apply_propagated(video_filename, 1, tracked)
+    assert np.array_equal(model.store.get(model._image_filename(1), 1),
+                          tracked)
+    # the current frame is not overwritten either
+    assert not model.apply_propagated(video_filename, 0, tracked)
+    assert model.bounding_boxes[0][:2] == [[10, 10], [20, 20]]
+
+
+def test_unavailable_tracker_falls_back_to_optical_flow(tmp_path,
+                                                        monkeypatch):
+    monkeypatch.setattr(BoxPropagator, "tracker_factory",
+                        classmethod(lambda cls, tracker: None))
+    with pytest.warns(UserWarning, match="optical flow"):
+        config = _config(tmp_path, "kcf")
+    assert config.tracker == "optical_flow"
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert _config(tmp_path, "optical_flow").tracker == "optical_flow"
+
+
+def _frame_boxes(model, frame_idx):
+    return model.store.get(model._image_filename(frame_idx), frame_idx)
+
+
+def test_interpolate(model):
+    model.add_box([0, 10], [30, 40], 0)
+    model.add_box([100, 80], [110, 90], 1)
+    track_ids = [bb[3] for bb in model.bounding_boxes]
+    model.skip(10)
+    # boxes are matched to the closest box of the same class
+    model.add_box([110, 70], [120, 80], 1)
+    model.add_box([20, 10], [50, 40], 0)
+    assert model.interpolate()
+
+    assert sorted(_frame_boxes(model, 10)[:, 5].tolist()) == sorted(track_ids)
+    for frame_idx in range(1, 10):
+        boxes = _frame_boxes(model, frame_idx)
+        boxes = boxes[np.argsort(boxes[:, 5])]
+        assert boxes[:, 5].tolist() == sorted(track_ids)
+        assert boxes[:, :5].tolist() == [
+            [2 * frame_idx, 10, 30 + 2 * frame_idx, 40, 0],
+            [100 + frame_idx, 80 - frame_idx, 110 + frame_idx,
+             90 - frame_idx, 1]]
+        assert np.all(boxes[:, 6] == 0)
+    assert model.missing_images == []
+
+
+def test_interpolate_starts_at_last_annotated_frame(model):
+    model.add_box([0, 10], [30, 40], 0)
+    model.skip(10)
+    model.add_box([20, 10], [50, 40], 0)
+    model.skip(10)
+    model.add_box([40, 10], [70, 40], 0)
+    annotated = [_frame_boxes(model, frame_idx).copy()
+                 for frame_idx in (0, 10)]
+    assert model.interpolate()
+
+    assert np.array_equal(_frame_boxes(model, 0), annotated[0])
+    assert np.array_equal(_frame_boxes(model, 10), annotated[1])
+    for frame_idx in range(1, 10):
+        assert len(_frame_boxes(model, frame_idx)) == 0
+    assert _frame_boxes(model, 15)[0, :4].tolist() == [30, 10, 60, 40]
+
+
+def test_interpolate_without_matching_tracks(model):
+    model.add_box([0, 10], [30, 40], 0)
+    model.skip(10)
+    model.add_box([20, 10], [50, 40], 1)
+    assert model.interpolate()
+    for frame_idx in range(1, 10):
+        assert len(_frame_boxes(model, frame_idx)) == 0
+
+
+def test_accept_range_writes_accepted_images(model):
+    model.add_box([0, 10], [30, 40], 0)
+    model.skip(5)
+    model.add_box([20, 10], [50, 40], 0)
+    assert model.interpolate()
+    model.save()
+    assert [model.image_writer.exists(model._image_filename(frame_idx))
+            for frame_idx in range(6)] == [True] + 4 * [False] + [True]
+
+    assert model.accept_range() == 4
+    for frame_idx in range(6):
+        assert np.all(_frame_boxes(model, frame_idx)[:, 6] == 1)
+    model.save()
+    assert all(model.image_writer.exists(model._image_filename(frame_idx))
+               for frame_idx in range(6))
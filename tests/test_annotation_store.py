@@ -0,0 +1,187 @@
+import numpy as np
+import pytest
+from main import AnnotationStore
+from annotated_images import annotated_image_filename, video_identifier
+
+
+def test_replace_get_delete(make_boxes):
+    store = AnnotationStore()
+    store.replace("a.jpg", 3, make_boxes(2))
+    store.replace("b.jpg", 4, make_boxes(3))
+    assert len(store) == 5
+    assert np.array_equal(store.get("a.jpg", 3), make_boxes(2))
+    assert store.get("a.jpg", 4).shape == (0, AnnotationStore.N_COLUMNS)
+
+    store.replace("a.jpg", 3, make_boxes(1))
+    assert len(store) == 4
+    # frames are ordered by their last change
+    assert list(store.frames) == [("b.jpg", 4), ("a.jpg", 3)]
+
+    store.replace("b.jpg", 4, [])
+    assert list(store.frames) == [("a.jpg", 3)]
+    store.delete("a.jpg", 3)
+    assert len(store) == 0
+    assert len(store.frames) == 0
+
+
+def test_version_changes_with_content(make_boxes):
+    store = AnnotationStore()
+    version = store.version
+    store.delete("a.jpg", 0)
+    assert store.version == version
+    store.replace("a.jpg", 0, make_boxes(1))
+    assert store.version > version
+    assert store.copy().version == store.version
+
+
+def test_max_track_id(make_boxes):
+    store = AnnotationStore()
+    assert store.max_track_id() == -1
+    store.replace("a.jpg", 0, make_boxes(2, first_track_id=7))
+    store.replace("a.jpg", 1, make_boxes(1, first_track_id=3))
+    assert store.max_track_id() == 8
+
+
+def test_video_frames(make_boxes):
+    store = AnnotationStore()
+    for frame_idx in [30, 10, 20]:
+        store.replace(annotated_image_filename("out", "video.mp4", frame_idx,
+                                               "jpg"),
+                      frame_idx, make_boxes(frame_idx // 10))
+    store.replace(annotated_image_filename("out", "other.mp4", 15, "jpg"), 15,
+                  make_boxes(1))
+
+    video_frames = store.video_frames(video_identifier("video.mp4"))
+    assert video_frames.frame_indices == [10, 20, 30]
+    assert video_frames.previous(20) == 10
+    assert video_frames.previous(25) == 20
+    assert video_frames.previous(10) is None
+    assert video_frames.image_filename(20) == annotated_image_filename(
+        "out", "video.mp4", 20, "jpg")
+    assert video_frames.image_filename(15) is None
+    assert video_frames.box_counts[[10, 20, 30]].tolist() == [1, 2, 3]
+
+    copied = store.copy()
+    store.delete(annotated_image_filename("out", "video.mp4", 20, "jpg"), 20)
+    assert video_frames.frame_indices == [10, 30]
+    assert video_frames.box_counts[20] == 0
+    assert copied.video_frames(
+        video_identifier("video.mp4")).frame_indices == [10, 20, 30]
+    assert len(store.video_frames(video_identifier("missing.mp4"))) == 0
+
+
+def _example_store(make_boxes):
+    store = AnnotationStore()
+    store.replace("out/b.jpg", 7, make_boxes(2, 1, 0))
+    store.replace("out/a.jpg", 3, make_boxes(3, 0, 5, reviewed=0))
+    store.replace("out/a.jpg", 4, make_boxes(1, 1, 9))
+    return store
+
+
+def _assert_equal_stores(store, loaded):
+    assert list(loaded.frames) == list(store.frames)
+    for key, boxes in store.frames.items():
+        assert np.array_equal(loaded.frames[key], boxes)
+    assert len(loaded) == len(store)
+
+
+def test_csv_round_trip(tmp_path, make_boxes):
+    store = _example_store(make_boxes)
+    filename = str(tmp_path / "annotations.csv")
+    store.save(filename)
+    assert (tmp_path / "annotations_attributes.npy").exists()
+    loaded = AnnotationStore()
+    loaded.load(filename)
+    _assert_equal_stores(store, loaded)
+
+
+def test_csv_without_attributes(tmp_path, make_boxes):
+    # track IDs are numbered and boxes are reviewed
+    store = _example_store(make_boxes)
+    filename = str(tmp_path / "annotations.csv")
+    store.save(filename)
+    (tmp_path / "annotations_attributes.npy").unlink()
+    loaded = AnnotationStore()
+    loaded.load(filename)
+    boxes = np.concatenate(list(loaded.frames.values()))
+    assert boxes[:, 5].tolist() == list(range(len(store)))
+    assert np.all(boxes[:, 6] == 1)
+
+
+def test_csv_with_other_attributes(tmp_path, make_boxes):
+    # attributes of another version of the CSV file are ignored
+    store = _example_store(make_boxes)
+    filename = str(tmp_path / "annotations.csv")
+    store.save(filename)
+    attributes = np.load(str(tmp_path / "annotations_attributes.npy"))
+    np.save(str(tmp_path / "annotations_attributes.npy"), attributes[:-1])
+    loaded = AnnotationStore()
+    with pytest.warns(UserWarning, match="does not match"):
+        loaded.load(filename)
+    boxes = np.concatenate(list(loaded.frames.values()))
+    assert boxes[:, 5].tolist() == list(range(len(store)))
+
+
+def test_npz_round_trip(tmp_path, make_boxes):
+    store = _example_store(make_boxes)
+    filename = str(tmp_path / "annotations.npz")
+    store.save(filename)
+    loaded = AnnotationStore()
+    loaded.load(filename)
+    _assert_equal_stores(store, loaded)
+
+
+def test_npz_video_frames(tmp_path, make_boxes):
+    # the per-video index of a loaded store matches the incremental one
+    store = AnnotationStore()
+    for frame_idx in [30, 10, 20]:
+        for video in ["video.mp4", "other.mp4"]:
+            store.replace(annotated_image_filename("out", video, frame_idx,
+                                                   "jpg"),
+                          frame_idx, make_boxes(frame_idx // 10))
+    store.replace("out/unrelated.jpg", 5, make_boxes(1))
+    filename = str(tmp_path / "annotations.npz")
+    store.save(filename)
+    loaded = AnnotationStore()
+    loaded.load(filename)
+    assert set(loaded.videos) == set(store.videos)
+    for identifier, video_frames in store.videos.items():
+        loaded_frames = loaded.video_frames(identifier)
+        assert loaded_frames.frame_indices == video_frames.frame_indices
+        assert loaded_frames.filenames == video_frames.filenames
+        assert np.array_equal(
+            loaded_frames.box_counts[video_frames.frame_indices],
+            video_frames.box_counts[video_frames.frame_indices])
+
+    # loading into a store with annotations merges them
+    loaded.load(filename)
+    assert len(loaded) == len(store)
+    assert loaded.video_frames(
+        video_identifier("video.mp4")).frame_indices == [10, 20, 30]
+
+
+def test_csv_to_npz_and_back(tmp_path, make_boxes):
+    store = _example_store(make_boxes)
+    store.save(str(tmp_path / "annotations.csv"))
+    from_csv = AnnotationStore()
+    from_csv.load(str(tmp_path / "annotations.csv"))
+    from_csv.save(str(tmp_path / "annotations.npz"))
+    from_npz = AnnotationStore()
+    from_npz.load(str(tmp_path / "annotations.npz"))
+    from_npz.save(str(tmp_path / "converted.csv"))
+    converted = AnnotationStore()
+    converted.load(str(tmp_path / "converted.csv"))
+    _assert_equal_stores(store, converted)
+    with open(str(tmp_path / "annotations.csv")) as f:
+        csv_content = f.read()
+    with open(str(tmp_path / "converted.csv")) as f:
+        assert f.read() == csv_content
+
+
+def test_empty_store_round_trip(tmp_path):
+    for annotation_format in AnnotationStore.FORMATS:
+        filename = str(tmp_path / ("annotations." + annotation_format))
+        AnnotationStore().save(filename)
+        loaded = AnnotationStore()
+        loaded.load(filename)
+        assert len(loaded.frames) == 0
@@ -0,0 +1,32 @@
+import pytest
+from main import AnnotatorConfigurationModel
+
+
+def _config(tmp_path, content):
+    filename = str(tmp_path / "config.yaml")
+    with open(filename, "w") as f:
+        f.write(content)
+    return AnnotatorConfigurationModel(filename)
+
+
+def test_valid_configuration(tmp_path):
+    config = _config(tmp_path, "classes: [a, b]\nresolution: [80, 60]\n")
+    assert config.classes == ["a", "b"]
+    assert config.n_classes == 2
+    assert config.image_size == (80, 60)
+
+
+@pytest.mark.parametrize("content", [
+    "resolution: [80, 60]\n",
+    "classes: []\nresolution: [80, 60]\n",
+    "classes: a\nresolution: [80, 60]\n",
+    "classes: [a]\n",
+    "classes: [a]\nresolution: [80]\n",
+    "classes: [a]\nresolution: [80, 0]\n",
+    "classes: [a]\nresolution: [80, 60.5]\n",
+    "classes: [a]\nresolution: [80, 60]\nimage_quality: 101\n",
+    "classes: [a]\nresolution: [80, 60]\nthumbnail_width: 8\n",
+])
+def test_invalid_configuration(tmp_path, content):
+    with pytest.raises(Exception):
+        _config(tmp_path, content)
@@ -0,0 +1,96 @@
+import os
+import json
+import tarfile
+import numpy as np
+import cv2
+import pytest
+from main import AnnotationStore, AnnotatorConfigurationModel, export
+
+
+def _config(tmp_path):
+    filename = str(tmp_path / "config.yaml")
+    with open(filename, "w") as f:
+        f.write("classes: [a, b]\nresolution: [200, 100]\n"
+                "tracker: optical_flow\n")
+    return AnnotatorConfigurationModel(filename)
+
+
+def _store(make_boxes):
+    # the second frame has only suggestions, the first one partially
+    store = AnnotationStore()
+    boxes = make_boxes(2, class_idx=1, first_track_id=3)
+    boxes[1, 6] = 0
+    store.replace("images/a.jpg", 7, boxes)
+    store.replace("images/b.jpg", 8, make_boxes(1, reviewed=0))
+    store.replace("images/c.jpg", 9, make_boxes(1, x=50, first_track_id=5))
+    return store
+
+
+@pytest.fixture(params=AnnotationStore.FORMATS)
+def annotations_filename(request, tmp_path, make_boxes):
+    filename = str(tmp_path / ("annotations." + request.param))
+    _store(make_boxes).save(filename)
+    return filename
+
+
+def test_stream(annotations_filename, make_boxes):
+    store = _store(make_boxes)
+    streamed = list(AnnotationStore.stream(annotations_filename))
+    assert [(image_filename, frame_idx)
+            for image_filename, frame_idx, _ in streamed] == list(store.frames)
+    for image_filename, frame_idx, boxes in streamed:
+        assert np.array_equal(boxes, store.get(image_filename, frame_idx))
+
+
+def test_export_coco(tmp_path, annotations_filename):
+    output_path = str(tmp_path / "coco")
+    export(annotations_filename, output_path, _config(tmp_path), "coco")
+    with open(os.path.join(output_path, "annotations_coco.json")) as f:
+        coco = json.load(f)
+    assert coco["categories"] == [{"id": 1, "name": "a"},
+                                  {"id": 2, "name": "b"}]
+    assert coco["images"] == [
+        {"id": 0, "file_name": "images/a.jpg", "width": 200, "height": 100,
+         "frame_idx": 7},
+        {"id": 1, "file_name": "images/c.jpg", "width": 200, "height": 100,
+         "frame_idx": 9}]
+    assert coco["annotations"] == [
+        {"id": 0, "image_id": 0, "category_id": 2, "bbox": [0, 5, 8, 15],
+         "area": 120, "iscrowd": 0, "track_id": 3},
+        {"id": 1, "image_id": 1, "category_id": 1, "bbox": [50, 5, 8, 15],
+         "area": 120, "iscrowd": 0, "track_id": 5}]
+
+
+def test_export_yolo(tmp_path, annotations_filename):
+    output_path = tmp_path / "yolo"
+    export(annotations_filename, str(output_path), _config(tmp_path), "yolo")
+    assert (output_path / "classes.txt").read_text() == "a\nb\n"
+    assert (output_path / "images.txt").read_text() == (
+        "images/a.jpg\nimages/c.jpg\n")
+    assert sorted(os.listdir(str(output_path / "labels"))) == [
+        "a.txt", "c.txt"]
+    assert (output_path / "labels" / "a.txt").read_text() == (
+        "1 0.020000 0.125000 0.040000 0.150000\n")
+    assert (output_path / "labels" / "c.txt").read_text() == (
+        "0 0.270000 0.125000 0.040000 0.150000\n")
+
+
+def test_export_webdataset(tmp_path, annotations_filename):
+    (tmp_path / "images").mkdir()
+    for name in ["a", "b", "c"]:
+        cv2.imwrite(str(tmp_path / "images" / (name + ".jpg")),
+                    np.zeros((100, 200, 3), dtype=np.uint8))
+    output_path = tmp_path / "webdataset"
+    export(annotations_filename, str(output_path), _config(tmp_path),
+           "webdataset", root_dir=str(tmp_path), shard_size=1)
+    assert sorted(os.listdir(str(output_path))) == [
+        "shard-000000.tar", "shard-000001.tar"]
+    with tarfile.open(str(output_path / "shard-000001.tar")) as tar:
+        assert tar.getnames() == ["c.jpg", "c.json"]
+        annotation = json.load(tar.extractfile("c.json"))
+        data = tar.extractfile("c.jpg").read()
+    assert data == (tmp_path / "images" / "c.jpg").read_bytes()
+    assert annotation == {
+        "file_name": "images/c.jpg", "frame_idx": 9, "width": 200,
+        "height": 100, "boxes": [[50, 5, 58, 20]], "classes": [0],
+        "track_ids": [5]}
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import cv2
+from main import (
+    AnnotationStore, AnnotatorConfigurationModel, KeyframeIndex, extract,
+    read_frames, annotated_image_filename)
+
+
+def test_read_frames_without_keyframe_index(video_filename, video_frames):
+    frame_indices = [40, 3, 17, 18, 59]
+    frames = dict(read_frames(video_filename, frame_indices, (160, 120)))
+    assert sorted(frames) == sorted(frame_indices)
+    for frame_idx, image in frames.items():
+        assert np.array_equal(image, video_frames[frame_idx])
+
+
+def test_read_frames_with_keyframe_index(tmp_path, video_filename,
+                                         video_frames):
+    keyframe_index = KeyframeIndex(
+        video_filename, str(tmp_path / "keyframes.npz"))
+    if keyframe_index.thread is not None:
+        keyframe_index.thread.join()
+    frame_indices = [40, 3, 17, 18, 59]
+    with_index = dict(read_frames(
+        video_filename, frame_indices, (160, 120), keyframe_index))
+    without_index = dict(read_frames(video_filename, frame_indices, (160, 120)))
+    assert sorted(with_index) == sorted(without_index)
+    for frame_idx in frame_indices:
+        assert np.array_equal(with_index[frame_idx], without_index[frame_idx])
+        assert np.array_equal(with_index[frame_idx], video_frames[frame_idx])
+
+
+def test_extract_with_several_processes(tmp_path, video_filename):
+    config_filename = str(tmp_path / "config.yaml")
+    with open(config_filename, "w") as f:
+        f.write("classes: [a, b]\nresolution: [80, 60]\nimage_format: png\n")
+    config = AnnotatorConfigurationModel(config_filename)
+    annotation_path = tmp_path / "annotations"
+    annotation_path.mkdir()
+    store = AnnotationStore()
+    for frame_idx in range(1, 60, 3):
+        store.replace(annotated_image_filename(
+            str(annotation_path), video_filename, frame_idx, "jpg"),
+            frame_idx, [[frame_idx, 10, frame_idx + 20, 50, frame_idx % 2,
+                         frame_idx, 1]])
+    annotations_filename = str(annotation_path / "annotations.csv")
+    store.save(annotations_filename)
+
+    extract(annotations_filename, str(tmp_path / "out1"), [video_filename],
+            config, (160, 120), 1)
+    extract(annotations_filename, str(tmp_path / "out3"), [video_filename],
+            config, (160, 120), 3)
+
+    store_1 = AnnotationStore()
+    store_1.load(str(tmp_path / "out1" / "annotations.csv"))
+    store_3 = AnnotationStore()
+    store_3.load(str(tmp_path / "out3" / "annotations.csv"))
+    assert len(store_1.frames) == len(store.frames)
+    keys_3 = [(os.path.basename(image_filename), frame_idx)
+              for image_filename, frame_idx in store_3.frames]
+    for i, ((image_filename, frame_idx), boxes) in enumerate(
+            store_1.frames.items()):
+        assert keys_3[i] == (os.path.basename(image_filename), frame_idx)
+        image_filename_3 = str(tmp_path / "out3" / keys_3[i][0])
+        assert np.array_equal(boxes, store_3.get(image_filename_3, frame_idx))
+        assert np.array_equal(cv2.imread(image_filename),
+                              cv2.imread(image_filename_3))
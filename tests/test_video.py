@@ -0,0 +1,203 @@
+import numpy as np
+import pytest
+import cv2
+from PyQt5.QtCore import QPoint, Qt
+from PyQt5.QtTest import QTest
+from main import (
+    FramePrefetcher, KeyframeIndex, ProxyVideo, ThumbnailCache, Timeline,
+    VideoModel, difference_hash)
+from conftest import N_FRAMES, VIDEO_SIZE
+
+
+def _prefetcher(video_filename, keyframe_index, n_frames=8):
+    prefetcher = FramePrefetcher(
+        cv2.VideoCapture(video_filename), VIDEO_SIZE, n_frames, keyframe_index)
+    prefetcher.start()
+    return prefetcher
+
+
+def _assert_frames(prefetcher, video_frames, frame_indices):
+    for frame_idx in frame_indices:
+        image = prefetcher.frame(frame_idx)
+        assert image is not None, frame_idx
+        assert np.array_equal(image, video_frames[frame_idx]), frame_idx
+
+
+def test_prefetcher_seeks_without_keyframes(video_filename, video_frames):
+    # frames after seeking backwards, forwards and within the ring are the
+    # same as in a sequential decode
+    prefetcher = _prefetcher(
+        video_filename, KeyframeIndex(video_filename, build=False))
+    try:
+        _assert_frames(prefetcher, video_frames,
+                       [0, 1, 2, 5, 40, 41, 3, 17, 18, 24, 59])
+        assert prefetcher.frame(N_FRAMES) is None
+        _assert_frames(prefetcher, video_frames, [10])
+    finally:
+        prefetcher.stop()
+
+
+def _keyframe_index(video_filename, cache_filename=None):
+    keyframe_index = KeyframeIndex(video_filename, cache_filename)
+    if keyframe_index.thread is not None:
+        keyframe_index.thread.join()
+    return keyframe_index
+
+
+def test_keyframe_index(tmp_path, video_filename):
+    cache_filename = str(tmp_path / "keyframes.npz")
+    keyframe_index = _keyframe_index(video_filename, cache_filename)
+    if keyframe_index.keyframes is None:
+        pytest.skip("OpenCV cannot read undecoded packets")
+    keyframes = keyframe_index.keyframes
+    assert keyframes[0] == 0
+    assert keyframes == sorted(keyframes)
+    assert keyframe_index.keyframe_before(0) == 0
+    assert keyframe_index.keyframe_before(N_FRAMES - 1) == keyframes[-1]
+    for keyframe_idx in keyframes:
+        assert keyframe_index.keyframe_before(keyframe_idx) == keyframe_idx
+        if keyframe_idx > 0:
+            assert keyframe_index.keyframe_before(keyframe_idx - 1) < keyframe_idx
+
+    # the cache is used instead of reading the video again
+    cached = KeyframeIndex(video_filename, cache_filename)
+    assert cached.thread is None
+    assert cached.keyframes == keyframes
+
+
+def test_prefetcher_seeks_to_keyframes(tmp_path, video_filename,
+                                       video_frames):
+    keyframe_index = _keyframe_index(
+        video_filename, str(tmp_path / "keyframes.npz"))
+    if keyframe_index.keyframes is None:
+        pytest.skip("OpenCV cannot read undecoded packets")
+    prefetcher = _prefetcher(video_filename, keyframe_index)
+    try:
+        # within the group of pictures of the last decoded frame, in other
+        # groups of pictures and on keyframes
+        _assert_frames(prefetcher, video_frames,
+                       [0, 30, 33, 35, 5, 12, 11, 47, 48, 59, 13])
+    finally:
+        prefetcher.stop()
+
+
+def test_thumbnails(tmp_path, video_filename, video_frames):
+    cache_prefix = str(tmp_path / "thumbnails")
+    thumbnails = ThumbnailCache(
+        video_filename, N_FRAMES, (16, 12), cache_prefix)
+    thumbnails.thread.join()
+    assert thumbnails.complete
+    assert thumbnails.n_computed == N_FRAMES
+    for frame_idx in [0, 25, N_FRAMES - 1]:
+        expected = cv2.resize(video_frames[frame_idx], (16, 12),
+                              interpolation=cv2.INTER_AREA)
+        assert np.array_equal(thumbnails.thumbnail(frame_idx), expected)
+        assert thumbnails.signatures[frame_idx] == difference_hash(expected)
+    assert thumbnails.thumbnail(N_FRAMES) is None
+
+    # the cache is used instead of reading the video again
+    cached = ThumbnailCache(video_filename, N_FRAMES, (16, 12), cache_prefix)
+    assert cached.thread is None
+    assert cached.complete
+    assert np.array_equal(cached.signatures, thumbnails.signatures)
+    assert np.array_equal(cached.images, thumbnails.images)
+    # but not for thumbnails of another size
+    resized = ThumbnailCache(video_filename, N_FRAMES, (24, 18), cache_prefix)
+    resized.stop()
+    assert resized.thread is not None
+
+
+def test_next_distinct_frame(video_filename):
+    thumbnails = ThumbnailCache(video_filename, N_FRAMES, (16, 12))
+    thumbnails.thread.join()
+    signatures = thumbnails.signatures
+    for threshold in [0, 4, 8]:
+        distances = [
+            bin(int(signatures[frame_idx] ^ signatures[10])).count("1")
+            for frame_idx in range(N_FRAMES)]
+        expected = next((frame_idx for frame_idx in range(21, N_FRAMES)
+                         if distances[frame_idx] > threshold), None)
+        assert thumbnails.next_distinct_frame(10, 20, threshold) == expected
+    assert thumbnails.next_distinct_frame(10, 20, 64) is None
+    assert thumbnails.next_distinct_frame(N_FRAMES, 20, 0) is None
+
+
+def test_timeline(video_filename, qapp):
+    thumbnails = ThumbnailCache(video_filename, N_FRAMES, (16, 12))
+    thumbnails.thread.join()
+    timeline = Timeline()
+    timeline.set_video(thumbnails, N_FRAMES)
+    timeline.resize(120, timeline.height())
+    assert timeline.height() == 12 + Timeline.HEATMAP_HEIGHT
+
+    # mean number of boxes per bin relative to the maximum
+    box_counts = np.zeros(2 * Timeline.N_BINS, dtype=np.int32)
+    box_counts[:4] = [2, 2, 1, 0]
+    timeline.set_box_counts(box_counts)
+    assert timeline.heatmap_data.shape == (1, Timeline.N_BINS, 4)
+    assert timeline.heatmap_data[0, :3, 3].tolist() == [255, 64, 0]
+    timeline.grab()  # paints thumbnails and heatmap
+
+    selected = []
+    timeline.frame_selected.connect(selected.append)
+    QTest.mouseClick(timeline, Qt.LeftButton, pos=QPoint(60, 5))
+    QTest.mouseClick(timeline, Qt.LeftButton, pos=QPoint(119, 5))
+    assert selected == [N_FRAMES // 2, N_FRAMES - 1]
+
+
+def _error(image, expected):
+    return np.abs(image.astype(int) - expected.astype(int)).mean()
+
+
+def test_proxy(tmp_path, video_filename, video_frames):
+    cache_prefix = str(tmp_path / "proxy")
+    thumbnails = ThumbnailCache(video_filename, N_FRAMES, (16, 12),
+                                build=False)
+    proxy = ProxyVideo(video_filename, (80, 60), cache_prefix, thumbnails)
+    proxy.thread.join()
+    try:
+        # frames can be read in any order, they are close to the original
+        for frame_idx in [30, 5, 6, 59, 0, 45]:
+            image = proxy.frame(frame_idx)
+            assert image.shape == (60, 80, 3)
+            expected = cv2.resize(video_frames[frame_idx], (80, 60),
+                                  interpolation=cv2.INTER_AREA)
+            other = cv2.resize(video_frames[(frame_idx + 10) % N_FRAMES],
+                               (80, 60), interpolation=cv2.INTER_AREA)
+            assert _error(image, expected) < _error(image, other)
+        assert proxy.frame(N_FRAMES) is None
+    finally:
+        proxy.stop()
+
+    # thumbnails are computed in the same pass
+    assert thumbnails.complete
+    separate = ThumbnailCache(video_filename, N_FRAMES, (16, 12))
+    separate.thread.join()
+    assert np.array_equal(thumbnails.signatures, separate.signatures)
+    assert np.array_equal(thumbnails.images, separate.images)
+
+    # the proxy is transcoded again only if its size changes
+    cached = ProxyVideo(video_filename, (80, 60), cache_prefix)
+    assert cached.thread is None
+    assert cached.frame(3) is not None
+    cached.stop()
+    resized = ProxyVideo(video_filename, (40, 30), cache_prefix)
+    assert resized.thread is not None
+    resized.stop()
+
+
+def test_preview_from_proxy(tmp_path, video_filename, video_frames):
+    video_model = VideoModel(
+        video_filename, VIDEO_SIZE, n_prefetch_frames=4,
+        cache_path=str(tmp_path), thumbnail_width=16, proxy_width=80)
+    try:
+        video_model.proxy.thread.join()
+        assert video_model.thumbnails.complete
+        assert video_model.jump(20, preview=True) == 19
+        assert video_model.is_preview
+        assert video_model.image.shape == video_frames[19].shape
+        assert video_model.load_full_quality()
+        assert not video_model.is_preview
+        assert np.array_equal(video_model.image, video_frames[19])
+    finally:
+        video_model.close()